@@ -0,0 +1,295 @@
+"""
+Альтернативная точка входа бота на AsyncTeleBot.
+
+Все обработчики асинхронные: запросы к API идут через async_weather,
+а обращения к хранилищу выполняются в пуле потоков, поэтому один процесс
+обслуживает тысячи одновременных чатов. Тексты сообщений и клавиатуры
+общие с bot.py (модуль formatting).
+
+Запуск: python async_bot.py
+"""
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from telebot import asyncio_filters, types
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_handler_backends import State, StatesGroup
+from telebot.asyncio_storage import StateMemoryStorage
+
+import async_weather as weather
+import formatting
+import metrics
+import ratelimit
+import storage
+from formatting import (
+    main_menu_keyboard, forecast_keyboard, format_current_weather, format_comparison,
+    format_daily_forecast_list, format_hourly_forecast_detail, format_extended_weather
+)
+from scheduler import NotificationScheduler, group_by_city, next_interval
+
+load_dotenv()
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+if not TELEGRAM_TOKEN:
+    raise ValueError("Не найден TELEGRAM_TOKEN в .env файле!")
+
+# Порт эндпоинта /metrics (0 - не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+bot = AsyncTeleBot(TELEGRAM_TOKEN, parse_mode='HTML', state_storage=StateMemoryStorage())
+bot.add_custom_filter(asyncio_filters.StateFilter(bot))
+
+# Event loop, на котором работает бот; нужен потоку планировщика уведомлений
+_loop: asyncio.AbstractEventLoop | None = None
+
+class InputStates(StatesGroup):
+    """Состояния ожидания ввода (аналог register_next_step_handler в bot.py)."""
+    city = State()
+    comparison = State()
+
+async def notifications_keyboard(user_id: int):
+    """Создает inline-клавиатуру для управления уведомлениями."""
+    user_data = await asyncio.to_thread(storage.load_user, user_id)
+    return formatting.notifications_keyboard(user_data.get('notifications', {'enabled': False, 'interval_h': 3}))
+
+async def save_user_location(user_id: int, city: str, city_id: int | None, lat: float, lon: float):
+    """Сохраняет город (название и id OpenWeather) и координаты пользователя и пересчитывает его уведомления."""
+    def update():
+        storage.update_user(user_id, city=city, city_id=city_id, lat=lat, lon=lon)
+        scheduler.reschedule(user_id)
+    await asyncio.to_thread(update)
+
+async def send_notifications(users: dict) -> set:
+    """
+    Отправляет уведомления о погоде пачке пользователей.
+    Погода запрашивается по одному разу на город: для городов с известным id -
+    пачками до 20 городов за вызов API, для остальных - по названию, все параллельно.
+    Args:
+        users: Словарь {user_id: данные пользователя из хранилища}.
+    Returns:
+        Множество user_id, которым уведомление отправлено.
+    """
+    groups = group_by_city(users)
+    names = {key: users[user_ids[0]]['city'] for key, user_ids in groups.items() if not isinstance(key, int)}
+    with ratelimit.background():
+        by_id, *by_name = await asyncio.gather(
+            weather.get_weather_for_cities(key for key in groups if isinstance(key, int)),
+            *(weather.get_weather_by_city(city) for city in names.values())
+        )
+    results = {**by_id, **dict(zip(names, by_name))}
+
+    async def deliver(user_id: int, text: str) -> int | None:
+        try:
+            await bot.send_message(user_id, "🔔 <b>Ваше уведомление о погоде</b>")
+            await bot.send_message(user_id, text)
+        except Exception as e:
+            print(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+            return None
+        return user_id
+
+    sends = []
+    for key, user_ids in groups.items():
+        weather_data = results.get(key)
+        if not weather_data:
+            continue
+        text = format_current_weather(weather_data)
+        sends.extend(deliver(user_id, text) for user_id in user_ids)
+    return {user_id for user_id in await asyncio.gather(*sends) if user_id is not None}
+
+def _notify_batch(users: dict) -> set:
+    """Передает пачку уведомлений из потока планировщика в event loop бота."""
+    return asyncio.run_coroutine_threadsafe(send_notifications(users), _loop).result()
+
+scheduler = NotificationScheduler(_notify_batch)
+
+
+@bot.message_handler(commands=['start'])
+async def send_welcome(message: types.Message):
+    """Обработчик команды /start."""
+    user = message.from_user
+    await bot.send_message(
+        message.chat.id,
+        f"Привет, {user.first_name}! 👋\n\nЯ твой погодный бот. Выбери, что хочешь узнать:",
+        reply_markup=main_menu_keyboard()
+    )
+
+@bot.message_handler(content_types=['location'])
+async def handle_location(message: types.Message):
+    """
+    Обрабатывает геолокацию, отправленную пользователем.
+    Погода и название города берутся из одного запроса к API по координатам.
+    """
+    lat, lon = message.location.latitude, message.location.longitude
+
+    weather_data = await weather.get_weather_by_coords(lat, lon)
+    city_name = weather_data and weather_data.get('name')
+    if not city_name:
+        await bot.send_message(message.chat.id, "Не удалось определить ваш город. Попробуйте ввести его вручную.", reply_markup=main_menu_keyboard())
+        return
+
+    await save_user_location(message.from_user.id, city_name, weather_data.get('id'), lat, lon)
+
+    await bot.send_message(message.chat.id, f"📍 Ваша геолокация определена как: {city_name}. Сохраняю...")
+    await bot.send_message(message.chat.id, format_current_weather(weather_data), reply_markup=main_menu_keyboard())
+
+@bot.callback_query_handler(func=lambda call: True)
+async def handle_inline_buttons(call: types.CallbackQuery):
+    """Обрабатывает нажатия на все inline-кнопки."""
+    user_id = call.from_user.id
+
+    if call.data.startswith("forecast_day_"):
+        day_offset = int(call.data.split("_")[2])
+        user_data = await asyncio.to_thread(storage.load_user, user_id)
+        city = user_data.get("city")
+        if not city: return await bot.answer_callback_query(call.id, "Сначала сохраните геолокацию или введите город.", show_alert=True)
+
+        forecast_data = await weather.get_forecast_by_city(city)
+        await bot.edit_message_text(
+            chat_id=call.message.chat.id, message_id=call.message.message_id,
+            text=format_hourly_forecast_detail(forecast_data, day_offset),
+            reply_markup=types.InlineKeyboardMarkup().add(types.InlineKeyboardButton("⬅️ Назад к выбору дня", callback_data="forecast_back"))
+        )
+
+    elif call.data == "forecast_back":
+        user_data = await asyncio.to_thread(storage.load_user, user_id)
+        city = user_data.get("city")
+        if not city: return await bot.answer_callback_query(call.id, "Ошибка: город не найден.")
+
+        forecast_data = await weather.get_forecast_by_city(city)
+        await bot.edit_message_text(
+            chat_id=call.message.chat.id, message_id=call.message.message_id,
+            text=format_daily_forecast_list(forecast_data),
+            reply_markup=forecast_keyboard()
+        )
+
+    elif call.data == "notify_toggle":
+        def toggle() -> bool:
+            user_data = storage.update_user(user_id, notifications__enabled=lambda enabled: not enabled)
+            scheduler.reschedule(user_id)
+            return user_data['notifications']['enabled']
+
+        status = "включены" if await asyncio.to_thread(toggle) else "выключены"
+        await bot.answer_callback_query(call.id, f"Уведомления {status}.")
+        await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=await notifications_keyboard(user_id))
+
+    elif call.data == "notify_interval":
+        def change_interval() -> int:
+            user_data = storage.update_user(user_id, notifications__interval_h=next_interval)
+            scheduler.reschedule(user_id)
+            return user_data['notifications']['interval_h']
+
+        new_interval = await asyncio.to_thread(change_interval)
+        await bot.answer_callback_query(call.id, f"Интервал изменен на {new_interval} ч.")
+        await bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=await notifications_keyboard(user_id))
+
+
+@bot.message_handler(state=InputStates.city)
+async def get_weather_for_city_message(message: types.Message):
+    """
+    Получает погоду по названию города из сообщения
+    и отправляет результат пользователю.
+    """
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    city = message.text
+    weather_data = await weather.get_weather_by_city(city)
+
+    if not weather_data:
+        return await bot.send_message(message.chat.id, f"😔 Город '{city}' не найден.", reply_markup=main_menu_keyboard())
+
+    lat = weather_data['coord']['lat']
+    lon = weather_data['coord']['lon']
+    await save_user_location(message.from_user.id, weather_data['name'], weather_data.get('id'), lat, lon)
+
+    await bot.send_message(message.chat.id, format_current_weather(weather_data), reply_markup=main_menu_keyboard())
+
+@bot.message_handler(state=InputStates.comparison)
+async def process_comparison_request(message: types.Message):
+    """
+    Обрабатывает запрос на сравнение погоды в нескольких городах.
+    Все города запрашиваются одновременно.
+    """
+    await bot.delete_state(message.from_user.id, message.chat.id)
+    cities = formatting.parse_comparison_cities(message.text)
+    if not cities:
+        return await bot.send_message(message.chat.id, f"Неверный формат. {formatting.COMPARISON_PROMPT}", reply_markup=main_menu_keyboard())
+
+    cities_data = await weather.get_weather_by_cities(cities)
+
+    missing = [f"'{city}'" for city, data in zip(cities, cities_data) if not data]
+    if missing: return await bot.send_message(message.chat.id, f"Не найдены города: {', '.join(missing)}.", reply_markup=main_menu_keyboard())
+
+    await bot.send_message(message.chat.id, format_comparison(cities_data), reply_markup=main_menu_keyboard())
+
+@bot.message_handler(func=lambda message: True)
+async def handle_text(message: types.Message):
+    """
+    Главный обработчик текстовых сообщений и нажатий на кнопки reply-клавиатуры.
+    """
+    text = message.text
+    user_id = message.from_user.id
+
+    if text == "Выбрать город 🌤️":
+        await bot.send_message(message.chat.id, "Введите название города:", reply_markup=types.ReplyKeyboardRemove())
+        await bot.set_state(user_id, InputStates.city, message.chat.id)
+
+    elif text == "Прогноз на 5 дней 🗓️":
+        user_data = await asyncio.to_thread(storage.load_user, user_id)
+        city = user_data.get("city")
+        if not city: return await bot.send_message(user_id, "Сначала сохраните геолокацию или введите город.", reply_markup=main_menu_keyboard())
+
+        forecast_data = await weather.get_forecast_by_city(city)
+        if not forecast_data: return await bot.send_message(user_id, "Не удалось получить прогноз.", reply_markup=main_menu_keyboard())
+        await bot.send_message(user_id, format_daily_forecast_list(forecast_data), reply_markup=forecast_keyboard())
+
+    elif text == "Сравнить города 🆚":
+        await bot.send_message(message.chat.id, formatting.COMPARISON_PROMPT, reply_markup=types.ReplyKeyboardRemove())
+        await bot.set_state(user_id, InputStates.comparison, message.chat.id)
+
+    elif text == "Расширенные данные 💨":
+        user_data = await asyncio.to_thread(storage.load_user, user_id)
+        city = user_data.get("city")
+        lat, lon = user_data.get("lat"), user_data.get("lon")
+
+        if not (city and lat and lon):
+            return await bot.send_message(user_id, "Сначала сохраните геолокацию или введите город.", reply_markup=main_menu_keyboard())
+
+        current_data, air_data = await asyncio.gather(
+            weather.get_weather_by_city(city), weather.get_air_quality(lat, lon)
+        )
+
+        await bot.send_message(user_id, format_extended_weather(current_data, air_data), reply_markup=main_menu_keyboard())
+
+    elif text == "Уведомления 🔔":
+        await bot.send_message(
+            user_id,
+            "Здесь вы можете настроить уведомления о погоде.\n\n"
+            "Бот будет присылать погоду для вашей сохраненной геолокации с заданным интервалом.",
+            reply_markup=await notifications_keyboard(user_id)
+        )
+
+    elif text == "Моя геолокация 📍":
+        await bot.send_message(message.chat.id, "Отправьте геолокацию, нажав на 📎 и выбрав 'Location'.")
+
+    else:
+        await get_weather_for_city_message(message)
+
+async def main():
+    """Запускает планировщик уведомлений и long polling на текущем event loop."""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    await asyncio.to_thread(scheduler.start)
+    try:
+        await bot.infinity_polling()
+    finally:
+        await asyncio.to_thread(scheduler.stop)
+        # Несохраненные изменения пользователей записываются до выхода
+        await asyncio.to_thread(storage.flush)
+        await weather.close()
+        await bot.close_session()
+
+if __name__ == '__main__':
+    print("Бот запущен...")
+    asyncio.run(main())
@@ -0,0 +1,311 @@
+"""
+Асинхронный клиент погоды с тем же публичным API, что и weather_app.
+
+Все запросы выполняются на одном event loop через общий пул соединений
+aiohttp, поэтому сотни запросов к API могут выполняться одновременно
+без отдельного потока на каждый (например, через asyncio.gather).
+Кэш, константы, разбор ответов и вся политика запросов (повторы, предел
+времени, ограничитель, выключатель, отрицательный кэш, данные из кэша при
+недоступности API) общие с weather_app и находятся в weather_core: здесь
+только асинхронный ввод-вывод и объединение запросов на event loop.
+"""
+import asyncio
+
+import aiohttp
+
+import geocoder
+import metrics
+import ratelimit
+import weather_core as core
+
+# Общий лимит одновременных соединений пула и лимит на один хост
+ASYNC_POOL_SIZE = 100
+ASYNC_POOL_SIZE_PER_HOST = 50
+
+_session: aiohttp.ClientSession | None = None
+# Выполняющиеся запросы к API по ключу: (future с результатом, приоритет
+# выполняющей задачи), см. _single_flight
+_flights = {}
+# Фоновые задачи обновления устаревших записей кэша по ключу single-flight
+_refresh_tasks = {}
+
+def _get_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общую для event loop HTTP-сессию, создавая ее при первом вызове.
+    Должна вызываться из работающего event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=ASYNC_POOL_SIZE, limit_per_host=ASYNC_POOL_SIZE_PER_HOST, ttl_dns_cache=300
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers={'User-Agent': 'TelegramWeatherBot/1.0'}
+        )
+    return _session
+
+async def close():
+    """Закрывает общую HTTP-сессию, отменив фоновые обновления кэша. Вызывается при остановке event loop."""
+    global _session
+    for task in list(_refresh_tasks.values()):
+        task.cancel()
+    await asyncio.gather(*_refresh_tasks.values(), return_exceptions=True)
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+def _timeout(remaining: float) -> aiohttp.ClientTimeout:
+    """Таймауты одной попытки с учетом оставшегося времени до общего предела."""
+    return aiohttp.ClientTimeout(
+        total=remaining,
+        sock_connect=min(core.HTTP_CONNECT_TIMEOUT_S, remaining),
+        sock_read=min(core.HTTP_READ_TIMEOUT_S, remaining)
+    )
+
+async def get_location_details_by_coords(lat: float, lon: float) -> tuple[str, str] | None:
+    """
+    Определяет город и код страны по координатам: сначала по офлайн-индексу
+    GeoNames, затем, если включено, с помощью Nominatim.
+    Args:
+        lat: Широта.
+        lon: Долгота.
+    Returns:
+        Кортеж (название города, код страны) или None в случае ошибки.
+    """
+    if geocoder.index_loaded():
+        details = geocoder.nearest_city(lat, lon)
+    else:
+        # Первое обращение строит индекс из файла, поэтому выполняется вне event loop
+        details = await asyncio.to_thread(geocoder.nearest_city, lat, lon)
+    if details or not core.NOMINATIM_FALLBACK:
+        return details
+    if not core.nominatim_breaker.allow():
+        return None
+    await asyncio.sleep(core.reserve_nominatim_slot())
+    try:
+        async with _get_session().get(
+            core.NOMINATIM_REVERSE_URL, params=core.nominatim_params(lat, lon),
+            timeout=_timeout(core.REQUEST_DEADLINE_S)
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+        core.nominatim_breaker.record_success()
+        return core.parse_location_details(data)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f"Ошибка при запросе к Nominatim: {e}")
+        core.nominatim_breaker.record_failure()
+        return None
+    except (KeyError, ValueError):
+        print("Ошибка при обработке ответа от Nominatim.")
+        return None
+
+async def make_request(url: str, params: dict):
+    """
+    Выполняет HTTP GET-запрос к API с обработкой ошибок и повторными попытками
+    по общей с weather_app политике (weather_core.request_policy).
+    Args:
+        url: URL-адрес эндпоинта API.
+        params: Словарь с параметрами запроса.
+    Returns:
+        Словарь с JSON-ответом от API или None в случае неудачи.
+    Raises:
+        weather_core.NotFoundError: API ответил 404; такой ответ окончательный и не повторяется.
+    """
+    policy = core.request_policy(url, params)
+    try:
+        step, arg = next(policy)
+        while True:
+            if step == core.STEP_ACQUIRE:
+                step, arg = policy.send(await core.owm_limiter.acquire_async(timeout=arg))
+            elif step == core.STEP_SLEEP:
+                await asyncio.sleep(arg)
+                step, arg = policy.send(None)
+            else:
+                try:
+                    async with _get_session().get(url, params=params, timeout=_timeout(arg)) as response:
+                        reply = response.status, await response.json() if response.ok else None
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    step, arg = policy.throw(core.AttemptFailed(e))
+                else:
+                    step, arg = policy.send(reply)
+    except StopIteration as stop:
+        return stop.value
+
+async def _run_fetch(steps, *args):
+    """
+    Выполняет шаги получения данных steps(*args) (генератор из weather_core),
+    отправляя выданные им запросы через make_request.
+    Returns:
+        Результат генератора.
+    """
+    gen = steps(*args)
+    try:
+        request = next(gen)
+        while True:
+            try:
+                data = await make_request(*request)
+            except core.NotFoundError as e:
+                request = gen.throw(e)
+            else:
+                request = gen.send(data)
+    except StopIteration as stop:
+        return stop.value
+
+class _LeaderCancelled(Exception):
+    """Задачу, выполнявшую объединенный запрос, отменили; ожидающие повторяют запрос сами."""
+
+async def _single_flight(key: tuple, steps, *args):
+    """
+    Объединяет одновременные одинаковые запросы на event loop: шаги steps(*args)
+    выполняет только первая задача, остальные с тем же ключом ждут ее результат.
+    Если первую задачу отменили (например, close() отменил фоновое обновление),
+    ожидающие не отменяются, а повторяют запрос. Если ожидание дольше
+    core.follower_timeout, задача получает данные из кэша (core.cached_result).
+    Args:
+        key: Ключ запроса (тип запроса и город или координаты).
+        steps: Шаги получения данных (см. _run_fetch).
+        args: Аргументы steps.
+    Returns:
+        Результат шагов.
+    """
+    while (entry := _flights.get(key)) is not None:
+        flight, priority = entry
+        metrics.inc("weather_singleflight_deduplicated_total", kind=key[0])
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight), core.follower_timeout(priority))
+        except _LeaderCancelled:
+            continue
+        except asyncio.TimeoutError:
+            metrics.inc("weather_singleflight_timeout_total", kind=key[0])
+            return core.cached_result(steps, *args)
+    metrics.inc("weather_singleflight_leader_total", kind=key[0])
+    flight = asyncio.get_running_loop().create_future()
+    _flights[key] = flight, ratelimit.current_priority()
+    try:
+        result = await _run_fetch(steps, *args)
+        flight.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        flight.set_exception(_LeaderCancelled())
+        flight.exception()
+        raise
+    except Exception as e:
+        flight.set_exception(e)
+        # Исключение получает сам вызывающий; без этого asyncio предупредит, если ожидающих не было
+        flight.exception()
+        raise
+    finally:
+        del _flights[key]
+
+def _refresh_in_background(key: tuple, steps, *args):
+    """
+    Запускает фоновую задачу обновления устаревшей записи кэша
+    (stale-while-revalidate), если такая еще не запущена.
+    Args:
+        key: Ключ single-flight запроса.
+        steps: Шаги получения данных, кладущие их в кэш (см. _run_fetch).
+        args: Аргументы steps.
+    """
+    if key in _refresh_tasks or key in _flights:
+        return
+    metrics.inc("weather_cache_background_refresh_total", kind=key[0])
+    _refresh_tasks[key] = asyncio.get_running_loop().create_task(_run_refresh(key, steps, *args))
+
+async def _run_refresh(key: tuple, steps, *args):
+    """Выполняет фоновое обновление записи кэша с фоновым приоритетом."""
+    try:
+        with ratelimit.background():
+            await _single_flight(key, steps, *args)
+    except Exception as e:
+        print(f"Ошибка фонового обновления кэша {key}: {e}")
+    finally:
+        del _refresh_tasks[key]
+
+async def _cached_or_fetch(lookup: tuple, key: tuple, steps, *args):
+    """Асинхронный вариант weather_app._cached_or_fetch: кэш, обновление в фоне или объединенный запрос."""
+    cached_data, stale = lookup
+    if cached_data:
+        if stale: _refresh_in_background(key, steps, *args)
+        return cached_data
+    return await _single_flight(key, steps, *args)
+
+async def get_weather_by_coords(lat: float, lon: float) -> dict | None:
+    """
+    Получает текущую погоду по координатам одним запросом к API, без обратного
+    геокодирования (см. weather_app.get_weather_by_coords).
+    Args:
+        lat: Широта.
+        lon: Долгота.
+    Returns:
+        Словарь с данными о погоде или None.
+    """
+    lat, lon = core.snap_to_grid(lat, lon)
+    return await _cached_or_fetch(core.lookup_cache_by_coords(lat, lon, 'weather'), ('weather_coords', lat, lon),
+                                  core.weather_by_coords_steps, lat, lon)
+
+async def get_weather_by_city(city: str) -> dict | None:
+    """
+    Получает текущую погоду для города (см. weather_app.get_weather_by_city).
+    Args:
+        city: Название города.
+    Returns:
+        Словарь с данными о погоде или None.
+    """
+    return await _cached_or_fetch(core.lookup_cache(city, 'weather'), core.city_flight_key('weather', city),
+                                  core.weather_by_city_steps, city)
+
+async def get_weather_for_cities(city_ids) -> dict:
+    """
+    Получает текущую погоду сразу для многих городов по их id OpenWeather
+    (см. weather_app.get_weather_for_cities); пачки по GROUP_MAX_IDS
+    запрашиваются одновременно.
+    Args:
+        city_ids: id городов OpenWeather.
+    Returns:
+        Словарь {id города: данные о погоде}; города без данных в нем отсутствуют.
+    """
+    result, missing = core.split_cached_group(city_ids)
+    chunks = core.group_chunks(missing)
+    for fetched in await asyncio.gather(*(_run_fetch(core.weather_group_steps, chunk) for chunk in chunks)):
+        result.update(fetched)
+    core.add_last_known(result, missing)
+    return result
+
+async def get_weather_by_cities(cities: list) -> list:
+    """
+    Получает текущую погоду для нескольких городов по названиям сразу
+    (см. weather_app.get_weather_by_cities).
+    Args:
+        cities: Названия городов.
+    Returns:
+        Список данных о погоде (или None) в порядке cities.
+    """
+    city_ids = [core.resolve_city_id(city) for city in cities]
+    by_id = await get_weather_for_cities(city_id for city_id in city_ids if city_id)
+    by_name = list(dict.fromkeys(city for city, city_id in zip(cities, city_ids) if city_id not in by_id))
+    fetched = dict(zip(by_name, await asyncio.gather(*(get_weather_by_city(city) for city in by_name))))
+    return core.merge_by_cities(cities, city_ids, by_id, fetched)
+
+async def get_forecast_by_city(city: str) -> dict | None:
+    """
+    Получает прогноз погоды на 5 дней для города (см. weather_app.get_forecast_by_city).
+    Args:
+        city: Название города.
+    Returns:
+        Словарь с данными прогноза или None.
+    """
+    return await _cached_or_fetch(core.lookup_cache(city, 'forecast'), core.city_flight_key('forecast', city),
+                                  core.forecast_by_city_steps, city)
+
+async def get_air_quality(lat: float, lon: float) -> dict | None:
+    """
+    Получает данные о качестве воздуха по координатам (см. weather_app.get_air_quality).
+    Args:
+        lat: Широта.
+        lon: Долгота.
+    Returns:
+        Словарь с данными о качестве воздуха или None.
+    """
+    return await _cached_or_fetch(core.lookup_cache_by_coords(lat, lon, 'air_quality'), ('air_quality', lat, lon),
+                                  core.air_quality_steps, lat, lon)
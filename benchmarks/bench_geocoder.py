@@ -0,0 +1,84 @@
+"""
+Замер офлайн-геокодера: время построения индекса, занимаемая память
+и задержка поиска ближайшего города.
+
+По умолчанию используется файл GEONAMES_FILE (data/cities15000.txt).
+Если его нет, генерируется синтетический файл того же формата.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_geocoder.py
+    python benchmarks/bench_geocoder.py --synthetic 30000 --queries 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import geocoder  # noqa: E402
+
+def write_synthetic(path: str, count: int, rng: random.Random):
+    """Пишет файл в формате GeoNames со случайными населенными пунктами на суше и в море."""
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(count):
+            lat = rng.uniform(-60, 75)
+            lon = rng.uniform(-180, 180)
+            fields = [str(i), f"City{i}", f"City{i}", "", f"{lat:.5f}", f"{lon:.5f}",
+                      "P", "PPL", "RU", "", "", "", "", "", "15000", "", "100", "Europe/Moscow", "2024-01-01"]
+            f.write("\t".join(fields) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="сгенерировать N синтетических городов вместо GEONAMES_FILE")
+    parser.add_argument("--queries", type=int, default=50000, help="число запросов поиска")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    path = geocoder.GEONAMES_FILE
+    tmp = None
+    if args.synthetic or not os.path.exists(path):
+        tmp = tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False)
+        tmp.close()
+        path = tmp.name
+        write_synthetic(path, args.synthetic or 30000, rng)
+        print(f"Синтетический файл: {args.synthetic or 30000} городов")
+    else:
+        print(f"Файл: {path}")
+
+    start = time.perf_counter()
+    index = geocoder.PlaceIndex.from_geonames(path)
+    build_s = time.perf_counter() - start
+    # Память меряем отдельным построением: tracemalloc сильно замедляет аллокации
+    del index
+    tracemalloc.start()
+    index = geocoder.PlaceIndex.from_geonames(path)
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024 / 1024
+    tracemalloc.stop()
+    if tmp:
+        os.unlink(path)
+
+    points = [(rng.uniform(-60, 75), rng.uniform(-180, 180)) for _ in range(args.queries)]
+    samples = []
+    found = 0
+    for lat, lon in points:
+        t = time.perf_counter()
+        if index.nearest(lat, lon):
+            found += 1
+        samples.append((time.perf_counter() - t) * 1e6)
+    samples.sort()
+
+    print(f"Городов в индексе: {index.size}")
+    print(f"Построение индекса: {build_s * 1000:.0f} мс")
+    print(f"Память индекса: {memory_mb:.1f} МБ")
+    print(
+        f"Поиск: mean={statistics.mean(samples):.1f} мкс  p50={samples[len(samples) // 2]:.1f} мкс  "
+        f"p99={samples[int(len(samples) * 0.99) - 1]:.1f} мкс  (найдено {found} из {len(points)})"
+    )
+
+if __name__ == "__main__":
+    main()
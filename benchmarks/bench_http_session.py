@@ -0,0 +1,89 @@
+"""
+Сравнение задержки запросов к API: отдельный requests.get на каждый вызов
+против общей keep-alive сессии weather_app.make_request.
+
+Запросы идут к локальному HTTP-серверу-заглушке, поэтому в разнице видна
+только стоимость установки TCP-соединения; для api.openweathermap.org
+к ней добавляется TLS-рукопожатие.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_http_session.py -n 500
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ratelimit  # noqa: E402
+import weather_app  # noqa: E402
+import weather_core  # noqa: E402
+
+PAYLOAD = json.dumps({
+    "name": "Москва",
+    "main": {"temp": 12.3, "feels_like": 11.0, "humidity": 70, "pressure": 1012},
+    "wind": {"speed": 3.1},
+    "weather": [{"description": "облачно"}]
+}, ensure_ascii=False).encode("utf-8")
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Отвечает фиксированным JSON и держит соединение открытым (HTTP/1.1)."""
+    protocol_version = "HTTP/1.1"
+    # Заголовки и тело уходят отдельными send(); без TCP_NODELAY keep-alive
+    # соединение упирается в задержанное подтверждение (~40 мс)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, format, *args):
+        pass
+
+def measure(label: str, call, n: int):
+    """Выполняет call() n раз и печатает статистику задержки в миллисекундах."""
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(
+        f"{label:<28} mean={statistics.mean(samples):.3f} ms  "
+        f"p50={samples[len(samples) // 2]:.3f} ms  "
+        f"p99={samples[int(len(samples) * 0.99) - 1]:.3f} ms"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=300, help="число запросов в каждом режиме")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/data/2.5/weather"
+    params = {"q": "Москва", "units": "metric", "lang": "ru"}
+
+    # Ограничитель запросов к OpenWeather (60 в минуту) иначе задавал бы
+    # темп make_request, и замер показывал бы паузы, а не стоимость соединений
+    weather_core.owm_limiter = ratelimit.TokenBucket(10**9)
+
+    # Прогрев, чтобы первый вызов не учитывал импорт и открытие пула
+    requests.get(url, params=params)
+    weather_app.make_request(url, dict(params))
+
+    measure("requests.get (без пула)", lambda: requests.get(url, params=params, timeout=10).json(), args.n)
+    measure("make_request (сессия)", lambda: weather_app.make_request(url, dict(params)), args.n)
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
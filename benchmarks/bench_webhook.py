@@ -0,0 +1,165 @@
+"""
+Нагрузочный тест приема обновлений: long polling против webhook.
+
+Поднимает локальный фейковый Bot API (getUpdates, sendMessage и т.д.)
+с искусственной сетевой задержкой и измеряет, за сколько бот обработает
+N обновлений /start в каждом режиме. В режиме polling обновления отдаются
+через getUpdates, в режиме webhook они отправляются POST-запросами на
+WebhookServer с той же параллельностью, что и у Telegram (max_connections).
+В обоих режимах обработчики выполняет одинаковое число потоков (--workers).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_webhook.py -n 1000 --rtt-ms 20
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+import telebot
+from telebot import apihelper
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from webhook import WebhookServer  # noqa: E402
+
+TOKEN = "123456:TEST"
+SECRET = "bench-secret"
+
+def make_update(update_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            "chat": {"id": update_id, "type": "private"},
+            "from": {"id": update_id, "is_bot": False, "first_name": "Bench"}
+        }
+    }
+
+class FakeTelegram:
+    """Фейковый Bot API: отдает заготовленные обновления и считает sendMessage."""
+
+    def __init__(self, rtt_ms: float):
+        self.rtt = rtt_ms / 1000
+        self.pending = []
+        self.sent = 0
+        self.cond = threading.Condition()
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/bot{{0}}/{{1}}"
+
+    def wait_sent(self, n: int):
+        with self.cond:
+            while self.sent < n:
+                self.cond.wait()
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.rfile.read(length)
+                method = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+                time.sleep(fake.rtt)
+                if method == "getUpdates":
+                    with fake.cond:
+                        batch, fake.pending = fake.pending[:100], fake.pending[100:]
+                    result = batch
+                elif method == "getMe":
+                    result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+                elif method == "sendMessage":
+                    with fake.cond:
+                        fake.sent += 1
+                        fake.cond.notify_all()
+                    result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+                else:
+                    result = True
+                body = json.dumps({"ok": True, "result": result}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def make_bot(threaded: bool, workers: int = 2) -> telebot.TeleBot:
+    bot = telebot.TeleBot(TOKEN, threaded=threaded, num_threads=workers)
+
+    @bot.message_handler(commands=["start"])
+    def start(message):
+        bot.send_message(message.chat.id, "Привет!")
+
+    return bot
+
+def bench_polling(fake: FakeTelegram, n: int, workers: int) -> float:
+    fake.sent = 0
+    fake.pending = [make_update(i) for i in range(1, n + 1)]
+    bot = make_bot(threaded=True, workers=workers)
+    start = time.perf_counter()
+    thread = threading.Thread(target=bot.polling, kwargs={"non_stop": True, "interval": 0, "timeout": 1}, daemon=True)
+    thread.start()
+    fake.wait_sent(n)
+    elapsed = time.perf_counter() - start
+    bot.stop_polling()
+    return elapsed
+
+def bench_webhook(fake: FakeTelegram, n: int, workers: int) -> float:
+    fake.sent = 0
+    server = WebhookServer(make_bot(threaded=False), SECRET, "127.0.0.1", 0, workers=workers)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}/webhook"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET, "Content-Type": "application/json"}
+    local = threading.local()
+
+    def post(update_id: int):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        while session.post(url, data=json.dumps(make_update(update_id)), headers=headers).status_code == 503:
+            time.sleep(0.01)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(post, range(1, n + 1)))
+    fake.wait_sent(n)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=500, help="число обновлений")
+    parser.add_argument("--rtt-ms", type=float, default=20, help="задержка ответа фейкового Bot API, мс")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="потоки обработчиков в обоих режимах и max_connections webhook")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.rtt_ms)
+    apihelper.API_URL = fake.api_url
+
+    for label, run in (("polling", lambda: bench_polling(fake, args.n, args.workers)),
+                       ("webhook", lambda: bench_webhook(fake, args.n, args.workers))):
+        elapsed = run()
+        print(f"{label:<8} {args.n} обновлений за {elapsed:.2f} с  ({args.n / elapsed:.0f} обновлений/с)")
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@ import os
 import telebot
 from telebot import types
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
-import collections
 
+import formatting
+import metrics
 import storage
 import weather_app as weather
+from formatting import (
+    main_menu_keyboard, forecast_keyboard, format_current_weather, format_comparison,
+    format_daily_forecast_list, format_hourly_forecast_detail, format_extended_weather
+)
+from scheduler import NotificationScheduler, group_by_city, next_interval
+from webhook import WebhookServer
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -14,28 +20,19 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise ValueError("Не найден TELEGRAM_TOKEN в .env файле!")
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode='HTML')
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Порт эндпоинта /metrics (0 - не запускать)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Число потоков, обрабатывающих обновления (пул TeleBot или рабочие потоки WebhookServer)
+BOT_WORKERS = weather.BOT_WORKERS
 
-RUSSIAN_WEEKDAYS = ("Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье")
-
-def main_menu_keyboard():
-    """Создает и возвращает клавиатуру главного меню."""
-    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    btn1 = types.KeyboardButton("Выбрать город 🌤️")
-    btn2 = types.KeyboardButton("Прогноз на 5 дней 🗓️")
-    btn3 = types.KeyboardButton("Сравнить города 🆚")
-    btn4 = types.KeyboardButton("Моя геолокация 📍")
-    btn5 = types.KeyboardButton("Расширенные данные 💨")
-    btn6 = types.KeyboardButton("Уведомления 🔔")
-    markup.add(btn1, btn2, btn4, btn5, btn3, btn6)
-    return markup
-
-def forecast_keyboard():
-    """Создает и возвращает inline-клавиатуру для выбора дня прогноза."""
-    markup = types.InlineKeyboardMarkup(row_width=5)
-    buttons = [types.InlineKeyboardButton((datetime.now() + timedelta(days=i)).strftime("%d %b"), callback_data=f"forecast_day_{i}") for i in range(5)]
-    markup.add(*buttons)
-    return markup
+# В режиме webhook обработчики выполняются в рабочих потоках WebhookServer
+bot = telebot.TeleBot(TELEGRAM_TOKEN, parse_mode='HTML', threaded=BOT_MODE != "webhook", num_threads=BOT_WORKERS)
 
 def get_user_location(user_id: int):
     """
@@ -50,224 +47,45 @@ def get_user_location(user_id: int):
         return user_data["lat"], user_data["lon"]
     return None, None
 
-def format_current_weather(data: dict) -> str:
-    """
-    Форматирует данные о текущей погоде в читаемое сообщение.
-    Args:
-        data: Словарь с данными о погоде от API.
-    Returns:
-        Готовое для отправки текстовое сообщение.
-    """
-    if not data:
-        return "Не удалось получить данные о погоде."
-    try:
-        city = data['name']
-        temp = data['main']['temp']
-        desc = data['weather'][0]['description'].capitalize()
-        feels = data['main']['feels_like']
-        wind = data['wind']['speed']
-        humidity = data['main']['humidity']
-        pressure = data['main']['pressure']
-
-        return (
-            f"🌤️ <b>Погода в {city}</b>\n\n"
-            f"🌡️ Температура: <b>{temp:.1f}°C</b>\n"
-            f"🤔 Ощущается как: <b>{feels:.1f}°C</b>\n\n"
-            f"💧 Влажность: {humidity}%\n"
-            f"🌬️ Ветер: {wind} м/с\n"
-            f"📊 Давление: {pressure} гПа\n\n"
-            f"☁️ {desc}"
-        )
-    except (KeyError, IndexError):
-        return "Ошибка при обработке данных о погоде."
-
-def format_comparison(data1: dict, data2: dict) -> str:
-    """
-    Форматирует сравнение погоды в двух городах.
-    Args:
-        data1: Данные о погоде для первого города.
-        data2: Данные о погоде для второго города.
-    Returns:
-        Готовое для отправки текстовое сообщение со сравнением.
-    """
-    try:
-        city1, temp1, hum1, wind1, press1, desc1 = (
-            data1['name'], data1['main']['temp'], data1['main']['humidity'],
-            data1['wind']['speed'], data1['main']['pressure'],
-            data1['weather'][0]['description'].capitalize()
-        )
-        city2, temp2, hum2, wind2, press2, desc2 = (
-            data2['name'], data2['main']['temp'], data2['main']['humidity'],
-            data2['wind']['speed'], data2['main']['pressure'],
-            data2['weather'][0]['description'].capitalize()
-        )
-
-        temp_diff = abs(temp1 - temp2)
-        warmer_city = city1 if temp1 > temp2 else city2
-
-        return (
-            f"⚖️ <b>Сравнение погоды</b>\n<b>{city1} vs {city2}</b>\n\n"
-            f"🌡️ <b>Температура:</b>\n{city1}: {temp1:.1f}°C\n{city2}: {temp2:.1f}°C\n"
-            f"🔥 В {warmer_city} теплее на {temp_diff:.1f}°C\n\n"
-            f"💧 <b>Влажность:</b>\n{city1}: {hum1}%\n{city2}: {hum2}%\n\n"
-            f"🌬️ <b>Ветер:</b>\n{city1}: {wind1} м/с\n{city2}: {wind2} м/с\n\n"
-            f"📊 <b>Давление:</b>\n{city1}: {press1} гПа\n{city2}: {press2} гПа\n\n"
-            f"☁️ <b>Условия:</b>\n{city1}: {desc1}\n{city2}: {desc2}"
-        )
-    except (TypeError, KeyError):
-        return "Не удалось сравнить погоду. Данные для одного из городов неполные."
-
-def format_daily_forecast_list(forecast_data: dict) -> str:
-    """
-    Форматирует общий прогноз на 5 дней со средними температурами.
-    Args:
-        forecast_data: Словарь с данными прогноза от API.
-    Returns:
-        Текстовое сообщение со списком дней для выбора.
-    """
-    city = forecast_data['city']['name']
-    daily_forecasts = collections.defaultdict(list)
-    for item in forecast_data['list']:
-        daily_forecasts[datetime.fromtimestamp(item['dt']).date()].append(item['main']['temp'])
-
-    text = f"📅 <b>Прогноз погоды на 5 дней</b>\n📍 <b>{city}</b>\n\nВыберите день для подробного прогноза:\n"
-    
-    for i, (day, temps) in enumerate(daily_forecasts.items()):
-        if i >= 5: break
-        avg_temp = sum(temps) / len(temps)
-        day_name = RUSSIAN_WEEKDAYS[day.weekday()]
-        day_str = f"{day.strftime('%d.%m')} - {day_name}"
-        text += f"\n☀️ {day_str} ({avg_temp:.1f}°C)"
-    
-    return text
-
-def format_hourly_forecast_detail(forecast_data: dict, day_offset: int) -> str:
-    """
-    Форматирует детальный почасовой прогноз на выбранный день.
-    Args:
-        forecast_data: Словарь с данными прогноза от API.
-        day_offset: Смещение дня от текущего (0 - сегодня, 1 - завтра и т.д.).
-    Returns:
-        Текстовое сообщение с почасовым прогнозом.
-    """
-    city = forecast_data['city']['name']
-    target_date = datetime.now().date() + timedelta(days=day_offset)
-    day_name = RUSSIAN_WEEKDAYS[target_date.weekday()]
-    target_date_str = f"{target_date.strftime('%d.%m.%Y')} - {day_name}"
-
-    day_forecasts = [item for item in forecast_data['list'] if datetime.fromtimestamp(item['dt']).date() == target_date]
-    if not day_forecasts: return f"Нет данных прогноза на {target_date_str}."
-
-    text = f"🗓️ <b>Подробный прогноз</b>\n📍 <b>{city}</b>\n\n📅 <b>{target_date_str}</b>\n"
-    for item in day_forecasts:
-        time_str = datetime.fromtimestamp(item['dt']).strftime('%H:%M')
-        temp = item['main']['temp']
-        desc = item['weather'][0]['description'].capitalize()
-        hour = int(time_str[:2])
-        emoji = "🌅" if 6 <= hour < 12 else "☀️" if 12 <= hour < 18 else "🌇" if 18 <= hour < 22 else "🌙"
-        text += f"\n{emoji} {time_str}: {temp:.1f}°C, {desc}"
-    return text
-
-def format_extended_weather(current_data: dict, air_data: dict) -> str:
-    """
-    Форматирует расширенные данные о погоде, включая качество воздуха.
-    Args:
-        current_data: Словарь с текущей погодой.
-        air_data: Словарь с данными о качестве воздуха.
-    Returns:
-        Текстовое сообщение с подробной информацией.
-    """
-    if not current_data:
-        return "Не удалось получить расширенные данные о погоде."
-    try:
-        city = current_data['name']
-        
-        temp = current_data['main']['temp']
-        feels_like = current_data['main']['feels_like']
-        humidity = current_data['main']['humidity']
-        pressure = current_data['main']['pressure']
-        wind_speed = current_data['wind']['speed']
-        visibility = current_data.get('visibility', 10000) / 1000
-        clouds = current_data['clouds']['all']
-        
-        sunrise = datetime.fromtimestamp(current_data['sys']['sunrise']).strftime('%H:%M')
-        sunset = datetime.fromtimestamp(current_data['sys']['sunset']).strftime('%H:%M')
-        
-        description = current_data['weather'][0]['description'].capitalize()
-
-        text = (
-            f"📍 <b>Расширенные данные о погоде\n{city}</b>\n\n"
-            f"🌡️ Температура: {temp:.1f}°C (ощущается как {feels_like:.1f}°C)\n"
-            f"💧 Влажность: {humidity}%\n"
-            f"📊 Давление: {pressure} гПа\n"
-            f"🌬️ Ветер: {wind_speed} м/с\n"
-            f"👁️ Видимость: {visibility:.1f} км\n"
-            f"☁️ Облачность: {clouds}%\n"
-            f"🌅 Восход: {sunrise}\n"
-            f"🌇 Закат: {sunset}\n"
-        )
-
-        if air_data and 'list' in air_data:
-            aqi_status = weather.format_air_quality(air_data['list'][0]['main']['aqi'])
-            comp = air_data['list'][0]['components']
-            text += (
-                f"\n🏭 <b>Качество воздуха:</b>\n"
-                f"Общий статус: {aqi_status}\n"
-                f"O₃: {comp.get('o3', 0):.2f} мкг/м³"
-            )
-        
-        text += f"\n\n📝 <b>Условия:</b> {description}"
-        return text
-    except (KeyError, IndexError) as e:
-        return f"Ошибка при обработке расширенных данных: {e}"
-
 def notifications_keyboard(user_id: int):
     """Создает inline-клавиатуру для управления уведомлениями."""
     user_data = storage.load_user(user_id)
-    notifications = user_data.get('notifications', {'enabled': False, 'interval_h': 3})
-    
-    status_text = "Выключить 🔕" if notifications.get('enabled') else "Включить 🔔"
-    interval_text = f"Интервал: {notifications.get('interval_h', 3)} ч."
-
-    markup = types.InlineKeyboardMarkup(row_width=2)
-    markup.add(
-        types.InlineKeyboardButton(status_text, callback_data="notify_toggle"),
-        types.InlineKeyboardButton(interval_text, callback_data="notify_interval")
-    )
-    return markup
+    return formatting.notifications_keyboard(user_data.get('notifications', {'enabled': False, 'interval_h': 3}))
 
-def check_and_send_notification(user_id: int):
+def send_notifications(users: dict) -> set:
     """
-    Проверяет, нужно ли отправить пользователю уведомление о погоде,
-    и отправляет его, если все условия соблюдены.
+    Отправляет уведомления о погоде пачке пользователей.
+    Пользователи группируются по городу: погода для городов с известным id
+    запрашивается пачками (до 20 городов за вызов API), для остальных - по
+    названию; текст для каждого города форматируется один раз и рассылается всем.
+    Вызывается фоновым планировщиком уведомлений.
+    Args:
+        users: Словарь {user_id: данные пользователя из хранилища}.
+    Returns:
+        Множество user_id, которым уведомление отправлено.
     """
-    user_data = storage.load_user(user_id)
-    notifications = user_data.get('notifications')
-    
-    if not (notifications and notifications.get('enabled')):
-        return
-        
-    now = datetime.now()
-    last_notified_str = notifications.get('last_notified_at')
-    interval = timedelta(hours=notifications.get('interval_h', 3))
-    
-    if last_notified_str:
-        last_notified_at = datetime.fromisoformat(last_notified_str)
-        if now - last_notified_at < interval:
-            return
-            
-    lat, lon = user_data.get('lat'), user_data.get('lon')
-    city = user_data.get('city')
-    if not (lat and lon and city):
-        return
-        
-    weather_data = weather.get_weather_by_city(city)
-    if weather_data:
-        bot.send_message(user_id, "🔔 <b>Ваше уведомление о погоде</b>")
-        bot.send_message(user_id, format_current_weather(weather_data))
-        
-        notifications['last_notified_at'] = now.isoformat()
-        storage.save_user(user_id, user_data)
+    delivered = set()
+    groups = group_by_city(users)
+    by_id = weather.get_weather_for_cities(key for key in groups if isinstance(key, int))
+    for key, user_ids in groups.items():
+        if isinstance(key, int):
+            weather_data = by_id.get(key)
+        else:
+            weather_data = weather.get_weather_by_city(users[user_ids[0]]['city'])
+        if not weather_data:
+            continue
+        text = format_current_weather(weather_data)
+        for user_id in user_ids:
+            try:
+                bot.send_message(user_id, "🔔 <b>Ваше уведомление о погоде</b>")
+                bot.send_message(user_id, text)
+            except Exception as e:
+                print(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+                continue
+            delivered.add(user_id)
+    return delivered
+
+scheduler = NotificationScheduler(send_notifications)
 
 
 @bot.message_handler(commands=['start'])
@@ -279,29 +97,23 @@ def send_welcome(message: types.Message):
         f"Привет, {user.first_name}! 👋\n\nЯ твой погодный бот. Выбери, что хочешь узнать:",
         reply_markup=main_menu_keyboard()
     )
-    check_and_send_notification(message.from_user.id)
 
 @bot.message_handler(content_types=['location'])
 def handle_location(message: types.Message):
-    """Обрабатывает геолокацию, отправленную пользователем."""
+    """
+    Обрабатывает геолокацию, отправленную пользователем.
+    Погода и название города берутся из одного запроса к API по координатам.
+    """
     lat, lon = message.location.latitude, message.location.longitude
     
-    location_details = weather.get_location_details_by_coords(lat, lon)
-    if not location_details:
+    weather_data = weather.get_weather_by_coords(lat, lon)
+    city_name = weather_data and weather_data.get('name')
+    if not city_name:
         bot.send_message(message.chat.id, "Не удалось определить ваш город. Попробуйте ввести его вручную.", reply_markup=main_menu_keyboard())
         return
 
-    city_name = location_details[0]
-    
-    weather_data = weather.get_weather_by_city(city_name)
-    
-    if not weather_data:
-        bot.send_message(message.chat.id, f"Не удалось получить погоду для {city_name}.", reply_markup=main_menu_keyboard())
-        return
-
-    user_settings = storage.load_user(message.from_user.id)
-    user_settings.update({"city": city_name, "lat": lat, "lon": lon})
-    storage.save_user(message.from_user.id, user_settings)
+    storage.update_user(message.from_user.id, city=city_name, city_id=weather_data.get('id'), lat=lat, lon=lon)
+    scheduler.reschedule(message.from_user.id)
     
     bot.send_message(message.chat.id, f"📍 Ваша геолокация определена как: {city_name}. Сохраняю...")
     bot.send_message(message.chat.id, format_current_weather(weather_data), reply_markup=main_menu_keyboard())
@@ -337,32 +149,17 @@ def handle_inline_buttons(call: types.CallbackQuery):
         )
 
     elif call.data == "notify_toggle":
-        user_data = storage.load_user(user_id)
-        if 'notifications' not in user_data:
-            user_data['notifications'] = {'enabled': False, 'interval_h': 3}
-            
-        user_data['notifications']['enabled'] = not user_data['notifications'].get('enabled', False)
-        storage.save_user(user_id, user_data)
+        user_data = storage.update_user(user_id, notifications__enabled=lambda enabled: not enabled)
+        scheduler.reschedule(user_id)
         
         status = "включены" if user_data['notifications']['enabled'] else "выключены"
         bot.answer_callback_query(call.id, f"Уведомления {status}.")
         bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=notifications_keyboard(user_id))
     
     elif call.data == "notify_interval":
-        user_data = storage.load_user(user_id)
-        if 'notifications' not in user_data:
-            user_data['notifications'] = {'enabled': False, 'interval_h': 3}
-            
-        current_interval = user_data['notifications'].get('interval_h', 3)
-        intervals = [1, 3, 6, 12, 24]
-        try:
-            next_index = (intervals.index(current_interval) + 1) % len(intervals)
-            new_interval = intervals[next_index]
-        except ValueError:
-            new_interval = 3
-            
-        user_data['notifications']['interval_h'] = new_interval
-        storage.save_user(user_id, user_data)
+        user_data = storage.update_user(user_id, notifications__interval_h=next_interval)
+        new_interval = user_data['notifications']['interval_h']
+        scheduler.reschedule(user_id)
         bot.answer_callback_query(call.id, f"Интервал изменен на {new_interval} ч.")
         bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=notifications_keyboard(user_id))
 
@@ -374,7 +171,6 @@ def handle_text(message: types.Message):
     """
     text = message.text
     user_id = message.from_user.id
-    check_and_send_notification(user_id)
 
     if text == "Выбрать город 🌤️":
         msg = bot.send_message(message.chat.id, "Введите название города:", reply_markup=types.ReplyKeyboardRemove())
@@ -390,7 +186,7 @@ def handle_text(message: types.Message):
         bot.send_message(user_id, format_daily_forecast_list(forecast_data), reply_markup=forecast_keyboard())
     
     elif text == "Сравнить города 🆚":
-        msg = bot.send_message(message.chat.id, "Введите два города через запятую (например: Москва, Лондон)", reply_markup=types.ReplyKeyboardRemove())
+        msg = bot.send_message(message.chat.id, formatting.COMPARISON_PROMPT, reply_markup=types.ReplyKeyboardRemove())
         bot.register_next_step_handler(msg, process_comparison_request)
 
     elif text == "Расширенные данные 💨":
@@ -434,29 +230,44 @@ def get_weather_for_city_message(message: types.Message):
     lat = weather_data['coord']['lat']
     lon = weather_data['coord']['lon']
     
-    user_settings = storage.load_user(message.from_user.id)
-    user_settings.update({"city": weather_data['name'], "lat": lat, "lon": lon})
-    storage.save_user(message.from_user.id, user_settings)
+    storage.update_user(message.from_user.id, city=weather_data['name'], city_id=weather_data.get('id'), lat=lat, lon=lon)
+    scheduler.reschedule(message.from_user.id)
     
     bot.send_message(message.chat.id, format_current_weather(weather_data), reply_markup=main_menu_keyboard())
 
 def process_comparison_request(message: types.Message):
     """
-    Обрабатывает запрос на сравнение погоды в двух городах.
+    Обрабатывает запрос на сравнение погоды в нескольких городах.
+    Все города запрашиваются одновременно.
     """
-    try:
-        city1_name, city2_name = [city.strip() for city in message.text.split(',')]
-    except ValueError:
-        return bot.send_message(message.chat.id, "Неверный формат. Введите два города через запятую.", reply_markup=main_menu_keyboard())
+    cities = formatting.parse_comparison_cities(message.text)
+    if not cities:
+        return bot.send_message(message.chat.id, f"Неверный формат. {formatting.COMPARISON_PROMPT}", reply_markup=main_menu_keyboard())
 
-    weather1 = weather.get_weather_by_city(city1_name)
-    weather2 = weather.get_weather_by_city(city2_name)
+    cities_data = weather.get_weather_by_cities(cities)
 
-    if not weather1: return bot.send_message(message.chat.id, f"Город '{city1_name}' не найден.", reply_markup=main_menu_keyboard())
-    if not weather2: return bot.send_message(message.chat.id, f"Город '{city2_name}' не найден.", reply_markup=main_menu_keyboard())
+    missing = [f"'{city}'" for city, data in zip(cities, cities_data) if not data]
+    if missing: return bot.send_message(message.chat.id, f"Не найдены города: {', '.join(missing)}.", reply_markup=main_menu_keyboard())
     
-    bot.send_message(message.chat.id, format_comparison(weather1, weather2), reply_markup=main_menu_keyboard())
+    bot.send_message(message.chat.id, format_comparison(cities_data), reply_markup=main_menu_keyboard())
 
 if __name__ == '__main__':
     print("Бот запущен...")
-    bot.polling(none_stop=True)
+    if METRICS_PORT:
+        metrics.start_http_server(METRICS_PORT)
+    scheduler.start()
+    try:
+        if BOT_MODE == "webhook":
+            if not (WEBHOOK_URL and WEBHOOK_SECRET):
+                raise ValueError("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET в .env файле!")
+            server = WebhookServer(bot, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, workers=BOT_WORKERS)
+            bot.remove_webhook()
+            bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, max_connections=server.workers)
+            server.serve_forever()
+        else:
+            bot.remove_webhook()
+            bot.polling(none_stop=True)
+    finally:
+        scheduler.stop()
+        # Несохраненные изменения пользователей записываются до выхода
+        storage.flush()
@@ -0,0 +1,129 @@
+"""
+Автоматический выключатель (circuit breaker) для внешних сервисов.
+
+Выключатель считает долю неудачных вызовов за скользящее окно. Когда она
+превышает порог, выключатель размыкается (open), и запросы к сервису не
+выполняются вовсе: вызывающий код сразу получает отказ и может отдать данные
+из кэша, не занимая поток повторами и паузами. Через reset_timeout_s
+выключатель становится полуоткрытым (half_open) и пропускает один пробный
+запрос; если он успешен, выключатель снова замыкается (closed).
+
+Состояние каждого выключателя публикуется метрикой circuit_breaker_state
+(0 - closed, 1 - open, 2 - half_open).
+"""
+import collections
+import threading
+import time
+
+import metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_OPEN: 1, STATE_HALF_OPEN: 2}
+
+class CircuitBreaker:
+    """Выключатель одного внешнего сервиса, общий для всех потоков и event loop."""
+
+    def __init__(self, name: str, failure_rate: float = 0.5, window_s: float = 60, min_calls: int = 5,
+                 reset_timeout_s: float = 30):
+        """
+        Args:
+            name: Название сервиса (для сообщений и метки метрик).
+            failure_rate: Доля неудачных вызовов в окне, при которой выключатель размыкается.
+            window_s: Длина скользящего окна в секундах.
+            min_calls: Минимум вызовов в окне, чтобы судить о доле неудач.
+            reset_timeout_s: Через сколько секунд после размыкания пропустить пробный запрос.
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.reset_timeout_s = reset_timeout_s
+        self._state = STATE_CLOSED
+        # Результаты вызовов в окне: (время, успех)
+        self._calls = collections.deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+        self._publish()
+
+    @property
+    def state(self) -> str:
+        """Текущее состояние: closed, open или half_open."""
+        return self._state
+
+    def _publish(self):
+        metrics.set_gauge("circuit_breaker_state", _STATE_VALUES[self._state], upstream=self.name)
+
+    def _set_state(self, state: str):
+        """Меняет состояние и публикует его. Вызывается под self._lock."""
+        self._state = state
+        if state == STATE_OPEN:
+            self._opened_at = time.monotonic()
+        self._calls.clear()
+        self._failures = 0
+        self._publish()
+
+    def _trim(self, now: float):
+        """Отбрасывает вызовы старше окна. Вызывается под self._lock."""
+        while self._calls and now - self._calls[0][0] > self.window_s:
+            _, ok = self._calls.popleft()
+            if not ok:
+                self._failures -= 1
+
+    def allow(self) -> bool:
+        """
+        Проверяет, можно ли сейчас обратиться к сервису.
+        В полуоткрытом состоянии разрешает только один пробный запрос; если его
+        результат так и не записан, через reset_timeout_s пропускается следующий.
+        Returns:
+            True, если запрос можно выполнять.
+        """
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+            now = time.monotonic()
+            if self._state == STATE_OPEN:
+                if now - self._opened_at < self.reset_timeout_s:
+                    metrics.inc("circuit_breaker_rejected_total", upstream=self.name)
+                    return False
+                self._set_state(STATE_HALF_OPEN)
+            elif now - self._probe_started_at < self.reset_timeout_s:
+                metrics.inc("circuit_breaker_rejected_total", upstream=self.name)
+                return False
+            self._probe_started_at = now
+            return True
+
+    def is_open(self) -> bool:
+        """Проверяет, разомкнут ли выключатель (например, чтобы прекратить повторы)."""
+        return self._state == STATE_OPEN
+
+    def record_success(self):
+        """Записывает успешный ответ сервиса; удачная проба замыкает выключатель."""
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                print(f"{self.name} снова доступен.")
+                self._set_state(STATE_CLOSED)
+                return
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append((now, True))
+
+    def record_failure(self):
+        """Записывает неудачу; размыкает выключатель при превышении доли неудач или неудачной пробе."""
+        with self._lock:
+            metrics.inc("circuit_breaker_failures_total", upstream=self.name)
+            if self._state == STATE_HALF_OPEN:
+                self._set_state(STATE_OPEN)
+                return
+            if self._state == STATE_OPEN:
+                return
+            now = time.monotonic()
+            self._trim(now)
+            self._calls.append((now, False))
+            self._failures += 1
+            if len(self._calls) >= self.min_calls and self._failures / len(self._calls) >= self.failure_rate:
+                print(f"{self.name} недоступен, запросы приостановлены на {self.reset_timeout_s} сек.")
+                self._set_state(STATE_OPEN)
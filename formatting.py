@@ -0,0 +1,250 @@
+import collections
+from datetime import datetime, timedelta
+
+from telebot import types
+
+import weather_app as weather
+
+RUSSIAN_WEEKDAYS = ("Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье")
+# Сколько городов можно сравнить за один запрос
+MAX_COMPARISON_CITIES = 5
+COMPARISON_PROMPT = (
+    f"Введите от 2 до {MAX_COMPARISON_CITIES} городов через запятую (например: Москва, Лондон, Париж)"
+)
+
+def main_menu_keyboard():
+    """Создает и возвращает клавиатуру главного меню."""
+    markup = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+    btn1 = types.KeyboardButton("Выбрать город 🌤️")
+    btn2 = types.KeyboardButton("Прогноз на 5 дней 🗓️")
+    btn3 = types.KeyboardButton("Сравнить города 🆚")
+    btn4 = types.KeyboardButton("Моя геолокация 📍")
+    btn5 = types.KeyboardButton("Расширенные данные 💨")
+    btn6 = types.KeyboardButton("Уведомления 🔔")
+    markup.add(btn1, btn2, btn4, btn5, btn3, btn6)
+    return markup
+
+def forecast_keyboard():
+    """Создает и возвращает inline-клавиатуру для выбора дня прогноза."""
+    markup = types.InlineKeyboardMarkup(row_width=5)
+    buttons = [types.InlineKeyboardButton((datetime.now() + timedelta(days=i)).strftime("%d %b"), callback_data=f"forecast_day_{i}") for i in range(5)]
+    markup.add(*buttons)
+    return markup
+
+def format_freshness_note(*datasets: dict) -> str:
+    """
+    Формирует пометку о том, что показаны сохраненные данные, если API был
+    недоступен и хотя бы один из ответов взят из кэша (см. weather.CACHED_AT_FIELD).
+    Args:
+        datasets: Данные, использованные в сообщении.
+    Returns:
+        Строка с пометкой (с отступом) или пустая строка.
+    """
+    cached_at = [data[weather.CACHED_AT_FIELD] for data in datasets if data and weather.CACHED_AT_FIELD in data]
+    if not cached_at:
+        return ""
+    oldest = datetime.fromtimestamp(min(cached_at)).strftime('%d.%m %H:%M')
+    return f"\n\n⚠️ <i>Сервис погоды сейчас недоступен, показаны данные от {oldest}.</i>"
+
+def format_current_weather(data: dict) -> str:
+    """
+    Форматирует данные о текущей погоде в читаемое сообщение.
+    Args:
+        data: Словарь с данными о погоде от API.
+    Returns:
+        Готовое для отправки текстовое сообщение.
+    """
+    if not data:
+        return "Не удалось получить данные о погоде."
+    try:
+        city = data['name']
+        temp = data['main']['temp']
+        desc = data['weather'][0]['description'].capitalize()
+        feels = data['main']['feels_like']
+        wind = data['wind']['speed']
+        humidity = data['main']['humidity']
+        pressure = data['main']['pressure']
+
+        return (
+            f"🌤️ <b>Погода в {city}</b>\n\n"
+            f"🌡️ Температура: <b>{temp:.1f}°C</b>\n"
+            f"🤔 Ощущается как: <b>{feels:.1f}°C</b>\n\n"
+            f"💧 Влажность: {humidity}%\n"
+            f"🌬️ Ветер: {wind} м/с\n"
+            f"📊 Давление: {pressure} гПа\n\n"
+            f"☁️ {desc}"
+            f"{format_freshness_note(data)}"
+        )
+    except (KeyError, IndexError):
+        return "Ошибка при обработке данных о погоде."
+
+def parse_comparison_cities(text: str) -> list | None:
+    """
+    Разбирает список городов для сравнения из сообщения пользователя.
+    Args:
+        text: Названия городов через запятую.
+    Returns:
+        Список названий без повторов или None, если городов меньше 2 или больше MAX_COMPARISON_CITIES.
+    """
+    cities = {}
+    for city in (text or "").split(','):
+        city = city.strip()
+        if city:
+            cities.setdefault(weather.normalize_city(city), city)
+    cities = list(cities.values())
+    if not 2 <= len(cities) <= MAX_COMPARISON_CITIES:
+        return None
+    return cities
+
+def format_comparison(cities_data: list) -> str:
+    """
+    Форматирует сравнение погоды в нескольких городах: рейтинг по температуре
+    и таблицу с основными показателями.
+    Args:
+        cities_data: Список данных о погоде для каждого города.
+    Returns:
+        Готовое для отправки текстовое сообщение со сравнением.
+    """
+    try:
+        rows = sorted(
+            (
+                (data['name'], data['main']['temp'], data['main']['humidity'], data['wind']['speed'],
+                 data['main']['pressure'], data['weather'][0]['description'].capitalize())
+                for data in cities_data
+            ),
+            key=lambda row: row[1], reverse=True
+        )
+        name_width = max(len('Город'), *(len(row[0]) for row in rows))
+
+        text = f"⚖️ <b>Сравнение погоды</b>\n<b>{' vs '.join(data['name'] for data in cities_data)}</b>\n\n"
+        text += "🌡️ <b>От самого теплого к самому холодному:</b>\n<pre>"
+        text += f"{'#':<2} {'Город':<{name_width}} {'°C':>6} {'Вл.%':>4} {'м/с':>5} {'гПа':>5}\n"
+        for place, (city, temp, hum, wind, press, _) in enumerate(rows, 1):
+            text += f"{place:<2} {city:<{name_width}} {temp:>6.1f} {hum:>4} {wind:>5} {press:>5}\n"
+        text += "</pre>\n"
+        warmest, coldest = rows[0], rows[-1]
+        text += f"🔥 В {warmest[0]} теплее, чем в {coldest[0]}, на {warmest[1] - coldest[1]:.1f}°C\n\n"
+        text += "☁️ <b>Условия:</b>\n" + "\n".join(f"{city}: {desc}" for city, *_, desc in rows)
+        return text + format_freshness_note(*cities_data)
+    except (TypeError, KeyError, IndexError, ValueError):
+        return "Не удалось сравнить погоду. Данные для одного из городов неполные."
+
+def format_daily_forecast_list(forecast_data: dict) -> str:
+    """
+    Форматирует общий прогноз на 5 дней со средними температурами.
+    Args:
+        forecast_data: Словарь с данными прогноза от API.
+    Returns:
+        Текстовое сообщение со списком дней для выбора.
+    """
+    city = forecast_data['city']['name']
+    daily_forecasts = collections.defaultdict(list)
+    for item in forecast_data['list']:
+        daily_forecasts[datetime.fromtimestamp(item['dt']).date()].append(item['main']['temp'])
+
+    text = f"📅 <b>Прогноз погоды на 5 дней</b>\n📍 <b>{city}</b>\n\nВыберите день для подробного прогноза:\n"
+    
+    for i, (day, temps) in enumerate(daily_forecasts.items()):
+        if i >= 5: break
+        avg_temp = sum(temps) / len(temps)
+        day_name = RUSSIAN_WEEKDAYS[day.weekday()]
+        day_str = f"{day.strftime('%d.%m')} - {day_name}"
+        text += f"\n☀️ {day_str} ({avg_temp:.1f}°C)"
+    
+    return text + format_freshness_note(forecast_data)
+
+def format_hourly_forecast_detail(forecast_data: dict, day_offset: int) -> str:
+    """
+    Форматирует детальный почасовой прогноз на выбранный день.
+    Args:
+        forecast_data: Словарь с данными прогноза от API.
+        day_offset: Смещение дня от текущего (0 - сегодня, 1 - завтра и т.д.).
+    Returns:
+        Текстовое сообщение с почасовым прогнозом.
+    """
+    city = forecast_data['city']['name']
+    target_date = datetime.now().date() + timedelta(days=day_offset)
+    day_name = RUSSIAN_WEEKDAYS[target_date.weekday()]
+    target_date_str = f"{target_date.strftime('%d.%m.%Y')} - {day_name}"
+
+    day_forecasts = [item for item in forecast_data['list'] if datetime.fromtimestamp(item['dt']).date() == target_date]
+    if not day_forecasts: return f"Нет данных прогноза на {target_date_str}."
+
+    text = f"🗓️ <b>Подробный прогноз</b>\n📍 <b>{city}</b>\n\n📅 <b>{target_date_str}</b>\n"
+    for item in day_forecasts:
+        time_str = datetime.fromtimestamp(item['dt']).strftime('%H:%M')
+        temp = item['main']['temp']
+        desc = item['weather'][0]['description'].capitalize()
+        hour = int(time_str[:2])
+        emoji = "🌅" if 6 <= hour < 12 else "☀️" if 12 <= hour < 18 else "🌇" if 18 <= hour < 22 else "🌙"
+        text += f"\n{emoji} {time_str}: {temp:.1f}°C, {desc}"
+    return text + format_freshness_note(forecast_data)
+
+def format_extended_weather(current_data: dict, air_data: dict) -> str:
+    """
+    Форматирует расширенные данные о погоде, включая качество воздуха.
+    Args:
+        current_data: Словарь с текущей погодой.
+        air_data: Словарь с данными о качестве воздуха.
+    Returns:
+        Текстовое сообщение с подробной информацией.
+    """
+    if not current_data:
+        return "Не удалось получить расширенные данные о погоде."
+    try:
+        city = current_data['name']
+        
+        temp = current_data['main']['temp']
+        feels_like = current_data['main']['feels_like']
+        humidity = current_data['main']['humidity']
+        pressure = current_data['main']['pressure']
+        wind_speed = current_data['wind']['speed']
+        visibility = current_data.get('visibility', 10000) / 1000
+        clouds = current_data['clouds']['all']
+        
+        sunrise = datetime.fromtimestamp(current_data['sys']['sunrise']).strftime('%H:%M')
+        sunset = datetime.fromtimestamp(current_data['sys']['sunset']).strftime('%H:%M')
+        
+        description = current_data['weather'][0]['description'].capitalize()
+
+        text = (
+            f"📍 <b>Расширенные данные о погоде\n{city}</b>\n\n"
+            f"🌡️ Температура: {temp:.1f}°C (ощущается как {feels_like:.1f}°C)\n"
+            f"💧 Влажность: {humidity}%\n"
+            f"📊 Давление: {pressure} гПа\n"
+            f"🌬️ Ветер: {wind_speed} м/с\n"
+            f"👁️ Видимость: {visibility:.1f} км\n"
+            f"☁️ Облачность: {clouds}%\n"
+            f"🌅 Восход: {sunrise}\n"
+            f"🌇 Закат: {sunset}\n"
+        )
+
+        if air_data and 'list' in air_data:
+            aqi_status = weather.format_air_quality(air_data['list'][0]['main']['aqi'])
+            comp = air_data['list'][0]['components']
+            text += (
+                f"\n🏭 <b>Качество воздуха:</b>\n"
+                f"Общий статус: {aqi_status}\n"
+                f"O₃: {comp.get('o3', 0):.2f} мкг/м³"
+            )
+        
+        text += f"\n\n📝 <b>Условия:</b> {description}"
+        return text + format_freshness_note(current_data, air_data)
+    except (KeyError, IndexError) as e:
+        return f"Ошибка при обработке расширенных данных: {e}"
+
+def notifications_keyboard(notifications: dict):
+    """
+    Создает inline-клавиатуру для управления уведомлениями.
+    Args:
+        notifications: Настройки уведомлений пользователя.
+    """
+    status_text = "Выключить 🔕" if notifications.get('enabled') else "Включить 🔔"
+    interval_text = f"Интервал: {notifications.get('interval_h', 3)} ч."
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(
+        types.InlineKeyboardButton(status_text, callback_data="notify_toggle"),
+        types.InlineKeyboardButton(interval_text, callback_data="notify_interval")
+    )
+    return markup
@@ -0,0 +1,155 @@
+"""
+Офлайн обратный геокодер по файлу городов GeoNames.
+
+Файл формата GeoNames (например, cities15000.txt с
+https://download.geonames.org/export/dump/) загружается в сеточный индекс
+с ячейками GRID_CELL_DEG градусов. Поиск ближайшего города просматривает
+только соседние ячейки (у полюсов - все ячейки ближайших широт) и занимает
+микросекунды.
+"""
+import math
+import os
+import threading
+
+GEONAMES_FILE = os.getenv("GEONAMES_FILE", os.path.join("data", "cities15000.txt"))
+GRID_CELL_DEG = 1.0
+# Дальше этого расстояния точка не считается относящейся к городу
+MAX_DISTANCE_KM = 50
+EARTH_RADIUS_KM = 6371.0
+# Выше этой широты кандидаты сравниваются по точному расстоянию: плоская
+# проекция там заметно искажает расстояния уже в пределах радиуса поиска
+EXACT_DISTANCE_LAT_DEG = 80
+
+class PlaceIndex:
+    """Сеточный пространственный индекс населенных пунктов."""
+
+    def __init__(self, cell_deg: float = GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        # (ячейка широты, ячейка долготы) -> [(lat, lon, название, код страны), ...]
+        self._cells = {}
+        self.size = 0
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        # Долгота приводится к [-180, 180), чтобы 180 и -180 попадали в одну ячейку
+        lon = (lon + 180) % 360 - 180
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def add(self, lat: float, lon: float, name: str, country_code: str):
+        """Добавляет населенный пункт в индекс."""
+        self._cells.setdefault(self._cell(lat, lon), []).append((lat, lon, name, country_code))
+        self.size += 1
+
+    @classmethod
+    def from_geonames(cls, path: str, cell_deg: float = GRID_CELL_DEG) -> "PlaceIndex":
+        """
+        Строит индекс по файлу GeoNames (табуляция, без заголовка).
+        Args:
+            path: Путь к файлу.
+            cell_deg: Размер ячейки сетки в градусах.
+        """
+        index = cls(cell_deg)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 9:
+                    continue
+                try:
+                    lat, lon = float(fields[4]), float(fields[5])
+                except ValueError:
+                    continue
+                index.add(lat, lon, fields[1], fields[8].upper())
+        return index
+
+    def nearest(self, lat: float, lon: float, max_distance_km: float = MAX_DISTANCE_KM) -> tuple[str, str] | None:
+        """
+        Ищет ближайший к точке населенный пункт.
+        Args:
+            lat: Широта.
+            lon: Долгота.
+            max_distance_km: Максимальное расстояние до города.
+        Returns:
+            Кортеж (название города, код страны) или None.
+        """
+        cell_lat, cell_lon = self._cell(lat, lon)
+        # Сколько ячеек нужно просмотреть в каждую сторону, чтобы покрыть радиус поиска
+        lat_reach = math.ceil(max_distance_km / (111.0 * self.cell_deg))
+        lon_cells = int(round(360 / self.cell_deg))
+        max_lat = abs(lat) + lat_reach * self.cell_deg
+        if max_lat >= 90:
+            # Радиус поиска задевает полюс: ближайший город может оказаться на любой долготе
+            lon_keys = range(-(lon_cells // 2), lon_cells - lon_cells // 2)
+        else:
+            # По долготе ячейки сужаются к полюсам
+            cos_lat = math.cos(math.radians(max_lat))
+            lon_reach = min(math.ceil(max_distance_km / (111.0 * self.cell_deg * cos_lat)), lon_cells // 2)
+            lon_keys = dict.fromkeys((cell_lon + d_lon + lon_cells // 2) % lon_cells - lon_cells // 2
+                                     for d_lon in range(-lon_reach, lon_reach + 1))
+        # Вдали от полюсов кандидатов сравниваем по дешевой равнопромежуточной
+        # проекции, точное расстояние считаем только для лучшего
+        exact = max_lat > EXACT_DISTANCE_LAT_DEG
+        cos_query = math.cos(math.radians(lat))
+        best, best_d2 = None, math.inf
+        for d_lat in range(-lat_reach, lat_reach + 1):
+            for lon_key in lon_keys:
+                for place in self._cells.get((cell_lat + d_lat, lon_key), ()):
+                    if exact:
+                        d2 = haversine_km(lat, lon, place[0], place[1])
+                    else:
+                        dy = place[0] - lat
+                        dx = ((place[1] - lon + 180) % 360 - 180) * cos_query
+                        d2 = dx * dx + dy * dy
+                    if d2 < best_d2:
+                        best, best_d2 = place, d2
+        if best is None or haversine_km(lat, lon, best[0], best[1]) > max_distance_km:
+            return None
+        return best[2], best[3]
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по дуге большого круга между двумя точками, км."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    d_lat = p2 - p1
+    d_lon = math.radians(lon2 - lon1)
+    a = math.sin(d_lat / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(d_lon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+_index: PlaceIndex | None = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+def get_index() -> PlaceIndex | None:
+    """
+    Возвращает индекс, при первом вызове строя его из GEONAMES_FILE.
+    Returns:
+        Индекс или None, если файла GeoNames нет.
+    """
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if not _index_loaded:
+            if os.path.exists(GEONAMES_FILE):
+                try:
+                    _index = PlaceIndex.from_geonames(GEONAMES_FILE)
+                except (IOError, UnicodeDecodeError) as e:
+                    print(f"Ошибка при загрузке {GEONAMES_FILE}: {e}")
+            _index_loaded = True
+    return _index
+
+def index_loaded() -> bool:
+    """Проверяет, была ли уже попытка построить индекс (дальнейшие вызовы не читают файл)."""
+    return _index_loaded
+
+def nearest_city(lat: float, lon: float) -> tuple[str, str] | None:
+    """
+    Определяет ближайший город и код страны по координатам без сетевых запросов.
+    Args:
+        lat: Широта.
+        lon: Долгота.
+    Returns:
+        Кортеж (название города, код страны) или None, если индекса нет
+        или поблизости нет городов.
+    """
+    index = get_index()
+    if index is None:
+        return None
+    return index.nearest(lat, lon)
@@ -0,0 +1,67 @@
+"""
+Простые метрики процесса: счетчики и текущие значения (gauges).
+
+Метрики отдаются в текстовом формате Prometheus: snapshot() для кода,
+render() для HTTP, start_http_server() поднимает эндпоинт /metrics.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+def _name(name: str, labels: dict | None) -> str:
+    """Полное имя метрики с метками в формате Prometheus."""
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+def inc(name: str, value: float = 1, **labels):
+    """Увеличивает счетчик."""
+    key = _name(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """Устанавливает текущее значение метрики."""
+    with _lock:
+        _gauges[_name(name, labels)] = value
+
+def snapshot() -> dict:
+    """Возвращает копию всех метрик {полное имя: значение}."""
+    with _lock:
+        return {**_counters, **_gauges}
+
+def render() -> str:
+    """Форматирует метрики в текстовом формате Prometheus."""
+    return "".join(f"{key} {value}\n" for key, value in sorted(snapshot().items()))
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Запускает в фоне HTTP-сервер с эндпоинтом /metrics.
+    Args:
+        port: Порт сервера.
+        host: Адрес, на котором слушает сервер.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
@@ -0,0 +1,144 @@
+"""
+Клиентский ограничитель частоты запросов (token bucket) с приоритетами.
+
+Запросы из обработчиков сообщений (интерактивные) всегда обслуживаются
+раньше фоновых (уведомления, обновление кэша): фоновый запрос не берет
+токен, пока ждет хотя бы один интерактивный, и не трогает резерв токенов.
+Приоритет текущего потока или задачи задается контекстом background().
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+_priority = contextvars.ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+def current_priority() -> int:
+    """Возвращает приоритет запросов в текущем контексте."""
+    return _priority.get()
+
+@contextlib.contextmanager
+def background():
+    """Помечает все запросы внутри блока (и порожденные в нем задачи asyncio) как фоновые."""
+    token = _priority.set(PRIORITY_BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class TokenBucket:
+    """
+    Token bucket, рассчитанный на квоту вида «N запросов в минуту».
+
+    Скорость пополнения выбирается как (квота - емкость) в минуту, поэтому
+    даже с полным ведром за любые 60 секунд расходуется не больше квоты.
+    """
+
+    def __init__(self, calls_per_minute: int, burst: int | None = None, background_reserve: int | None = None):
+        """
+        Args:
+            calls_per_minute: Квота тарифа, запросов в минуту.
+            burst: Емкость ведра (сколько запросов можно сделать разом).
+                По умолчанию десятая часть квоты.
+            background_reserve: Сколько токенов фоновые запросы оставляют
+                интерактивным. По умолчанию половина емкости.
+        """
+        self.capacity = burst if burst is not None else max(1, calls_per_minute // 10)
+        self.rate = max(calls_per_minute - self.capacity, 1) / 60
+        self.background_reserve = (
+            background_reserve if background_reserve is not None else self.capacity // 2
+        )
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._waiting_interactive = 0
+        self._cond = threading.Condition()
+
+    def _take(self, priority: int) -> float:
+        """
+        Пытается взять токен. Вызывается под self._cond.
+        Returns:
+            0, если токен получен, иначе сколько секунд стоит подождать.
+        """
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if priority == PRIORITY_BACKGROUND:
+            if self._waiting_interactive:
+                return 1 / self.rate
+            needed = 1 + self.background_reserve
+        else:
+            needed = 1
+        if self._tokens >= needed:
+            self._tokens -= 1
+            return 0
+        return (needed - self._tokens) / self.rate
+
+    def acquire(self, priority: int | None = None, timeout: float | None = None) -> bool:
+        """
+        Блокирует поток до получения токена.
+        Args:
+            priority: Приоритет запроса; по умолчанию берется из контекста.
+            timeout: Максимальное ожидание в секундах (None - без ограничения).
+        Returns:
+            True, если токен получен, False, если истек timeout.
+        """
+        if priority is None:
+            priority = current_priority()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            interactive = priority == PRIORITY_INTERACTIVE
+            if interactive:
+                self._waiting_interactive += 1
+            try:
+                while True:
+                    wait = self._take(priority)
+                    if wait == 0:
+                        return True
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            return False
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                if interactive:
+                    self._waiting_interactive -= 1
+                    self._cond.notify_all()
+
+    async def acquire_async(self, priority: int | None = None, timeout: float | None = None) -> bool:
+        """
+        Асинхронный вариант acquire(): ждет токен, не блокируя event loop.
+        Args:
+            priority: Приоритет запроса; по умолчанию берется из контекста.
+            timeout: Максимальное ожидание в секундах (None - без ограничения).
+        Returns:
+            True, если токен получен, False, если истек timeout.
+        """
+        if priority is None:
+            priority = current_priority()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interactive = priority == PRIORITY_INTERACTIVE
+        if interactive:
+            with self._cond:
+                self._waiting_interactive += 1
+        try:
+            while True:
+                with self._cond:
+                    wait = self._take(priority)
+                if wait == 0:
+                    return True
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                await asyncio.sleep(wait)
+        finally:
+            if interactive:
+                with self._cond:
+                    self._waiting_interactive -= 1
+                    self._cond.notify_all()
@@ -0,0 +1,158 @@
+import collections
+import math
+import threading
+import time
+from datetime import datetime
+
+import ratelimit
+import storage
+import weather_core
+
+# Интервалы уведомлений (часы), которые перебирает кнопка «Интервал»
+NOTIFY_INTERVALS_H = (1, 3, 6, 12, 24)
+# Через сколько секунд повторить уведомление, если его не удалось отправить
+RETRY_DELAY_S = 10 * 60
+# Сколько пользователей с наступившим сроком брать из хранилища за один раз
+NOTIFY_BATCH_SIZE = 500
+
+def next_interval(current_h: int | None) -> int:
+    """
+    Возвращает следующий интервал уведомлений по кругу NOTIFY_INTERVALS_H.
+    Args:
+        current_h: Текущий интервал в часах (None, если не задан).
+    Returns:
+        Новый интервал в часах.
+    """
+    if current_h is None:
+        current_h = storage.DEFAULT_INTERVAL_H
+    try:
+        return NOTIFY_INTERVALS_H[(NOTIFY_INTERVALS_H.index(current_h) + 1) % len(NOTIFY_INTERVALS_H)]
+    except ValueError:
+        return storage.DEFAULT_INTERVAL_H
+
+def group_by_city(users: dict) -> dict:
+    """
+    Группирует пользователей по городу: по id города OpenWeather (сохраненному
+    или найденному по написанию), иначе по нормализованному названию. Так погода
+    для каждого города запрашивается один раз.
+    Args:
+        users: Словарь {user_id: данные пользователя}.
+    Returns:
+        Словарь {id (int) или нормализованное название (str) города: [user_id, ...]}.
+    """
+    by_city = collections.defaultdict(list)
+    for user_id, user_data in users.items():
+        city = user_data['city']
+        key = user_data.get('city_id') or weather_core.resolve_city_id(city) or weather_core.normalize_city(city)
+        by_city[key].append(user_id)
+    return by_city
+
+class NotificationScheduler:
+    """
+    Фоновый планировщик периодических уведомлений.
+
+    Сроки уведомлений хранит индекс в storage (см. storage.due_users):
+    планировщик забирает из него пачки пользователей, которым пора, и спит
+    до ближайшего срока, поэтому обработчики сообщений не выполняют
+    никакой работы, связанной с уведомлениями.
+    """
+
+    def __init__(self, notify_batch):
+        """
+        Args:
+            notify_batch: Функция notify_batch(users) -> set, отправляющая уведомления
+                пачке пользователей {user_id: user_data}. Возвращает множество
+                user_id, которым уведомление доставлено.
+        """
+        self._notify_batch = notify_batch
+        # Будит поток раньше ближайшего срока, когда настройки пользователя изменились
+        self._wakeup = threading.Event()
+        # До какого момента спит поток (math.inf, пока он не спит)
+        self._deadline = math.inf
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Запускает фоновый поток."""
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="notification-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Останавливает фоновый поток."""
+        self._running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join()
+
+    def reschedule(self, user_id: int):
+        """
+        Учитывает изменение настроек уведомлений пользователя: индекс сроков
+        в storage уже обновлен при сохранении, поэтому поток будится, только
+        если новый срок пользователя раньше того, до которого он спит.
+        Args:
+            user_id: ID пользователя Telegram.
+        """
+        due = storage.next_due_at(storage.load_user(user_id))
+        if due is None:
+            return
+        with self._lock:
+            if due < self._deadline:
+                self._wakeup.set()
+
+    def _pop_due(self) -> dict:
+        """Ждет наступления ближайшего срока и возвращает пачку пользователей, которым пора."""
+        while self._running:
+            # Пока поток не спит, любое изменение будит его: сделанное после
+            # запроса к индексу не потеряется
+            with self._lock:
+                self._deadline = math.inf
+                self._wakeup.clear()
+            now = time.time()
+            users = storage.due_users(now, NOTIFY_BATCH_SIZE)
+            if users:
+                return users
+            due = storage.next_due_time()
+            with self._lock:
+                self._deadline = math.inf if due is None else due
+            self._wakeup.wait(None if due is None else max(due - now, 0))
+        return {}
+
+    def _run(self):
+        """Основной цикл потока планировщика. Все его запросы к API фоновые."""
+        with ratelimit.background():
+            self._loop()
+
+    def _loop(self):
+        while True:
+            users = self._pop_due()
+            if not users:
+                return
+            self._process(users)
+
+    def _process(self, batch: dict):
+        """Отправляет уведомления пачке пользователей и записывает следующие сроки."""
+        now = time.time()
+        # Пока пачка ждала, настройки пользователя могли измениться
+        users = {}
+        for user_id, user_data in batch.items():
+            due = storage.next_due_at(user_data)
+            if due is not None and due <= now:
+                users[user_id] = user_data
+        if not users:
+            return
+        try:
+            delivered = self._notify_batch(users)
+        except Exception as e:
+            print(f"Ошибка при отправке уведомлений: {e}")
+            delivered = set()
+        stamp = datetime.fromtimestamp(now).isoformat()
+        for user_id, user_data in users.items():
+            if user_id in delivered:
+                fields = {'notifications__last_notified_at': stamp}
+                if user_data['notifications'].get('retry_at'):
+                    fields['notifications__retry_at'] = None
+                storage.update_user(user_id, **fields)
+            else:
+                storage.update_user(user_id, notifications__retry_at=now + RETRY_DELAY_S)
@@ -1,10 +1,108 @@
+import atexit
+import bisect
+import contextlib
+import copy
 import json
+import math
 import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
 
 USER_DATA_FILE = "User_Data.json"
+USER_DB_FILE = "User_Data.db"
+# Движок хранения пользовательских данных: "json" (по умолчанию) или "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+# Как часто (мс) фоновый поток записывает накопленные изменения пользователей одной записью
+USER_FLUSH_INTERVAL_MS = 500
+# Размер блока чтения JSON-файла и пачки строк SQLite при потоковом обходе пользователей
+ITER_CHUNK_SIZE = 64 * 1024
+ITER_BATCH_SIZE = 500
+# Интервал уведомлений по умолчанию, часы
+DEFAULT_INTERVAL_H = 3
+
+# next_due_at - срок следующего уведомления (NULL, если уведомления не нужны);
+# частичный индекс по нему содержит только подписчиков
+_SQL_CREATE_TABLE = (
+    "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, next_due_at REAL)"
+)
+_SQL_CREATE_DUE_INDEX = (
+    "CREATE INDEX IF NOT EXISTS users_next_due_at ON users (next_due_at) WHERE next_due_at IS NOT NULL"
+)
+_SQL_SELECT_USER = "SELECT data FROM users WHERE user_id = ?"
+_SQL_UPSERT_USER = (
+    "INSERT INTO users (user_id, data, next_due_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, next_due_at = excluded.next_due_at"
+)
+_SQL_COUNT_USERS = "SELECT COUNT(*) FROM users"
+_SQL_SELECT_ALL = "SELECT user_id, data FROM users"
+_SQL_SELECT_PAGE = "SELECT user_id, data FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?"
+_SQL_SELECT_DUE = "SELECT user_id, next_due_at FROM users WHERE next_due_at IS NOT NULL"
+_SQL_SET_DUE = "UPDATE users SET next_due_at = ? WHERE user_id = ?"
+
+def next_due_at(user_data: dict) -> float | None:
+    """
+    Вычисляет момент следующего уведомления пользователя.
+    Args:
+        user_data: Словарь с данными пользователя из хранилища.
+    Returns:
+        Unix-время следующего уведомления или None, если уведомления
+        выключены или у пользователя нет сохраненной локации.
+    """
+    notifications = user_data.get('notifications')
+    if not (notifications and notifications.get('enabled')):
+        return None
+    if not (user_data.get('lat') and user_data.get('lon') and user_data.get('city')):
+        return None
+    # Неудачная отправка откладывает уведомление до retry_at
+    retry_at = notifications.get('retry_at') or 0.0
+    last_notified_str = notifications.get('last_notified_at')
+    if not last_notified_str:
+        return retry_at
+    try:
+        last_notified_at = datetime.fromisoformat(last_notified_str).timestamp()
+    except ValueError:
+        return retry_at
+    return max(last_notified_at + notifications.get('interval_h', DEFAULT_INTERVAL_H) * 3600, retry_at)
+
+def _split_path(field: str) -> tuple:
+    """Разбивает имя поля на путь ключей: "notifications.enabled" или "notifications__enabled"."""
+    return tuple(field.replace("__", ".").split("."))
+
+def _get_path(data: dict, path: tuple):
+    """Возвращает значение по пути ключей или None, если его нет."""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+def _set_path(data: dict, path: tuple, value) -> None:
+    """Записывает значение по пути ключей, создавая недостающие вложенные словари."""
+    for key in path[:-1]:
+        child = data.get(key)
+        if not isinstance(child, dict):
+            child = data[key] = {}
+        data = child
+    data[path[-1]] = value
 
-def _load_all_data() -> dict:
-    """Вспомогательная функция для загрузки всех данных из JSON-файла."""
+def _json_path(path: tuple) -> str:
+    """Путь ключей в синтаксисе JSON-функций SQLite: $."notifications"."enabled"."""
+    return "$" + "".join(f'."{key}"' for key in path)
+
+def _load_all_data(strict: bool = False) -> dict | None:
+    """
+    Вспомогательная функция для загрузки всех данных из JSON-файла.
+    Args:
+        strict: Вернуть None, а не пустой словарь, если файл поврежден или не читается.
+            Используется перед записью, чтобы не затереть файл с данными всех пользователей.
+    """
     if not os.path.exists(USER_DATA_FILE):
         return {}
     try:
@@ -13,39 +111,676 @@ def _load_all_data() -> dict:
             return {}
         with open(USER_DATA_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
-    except (IOError, json.JSONDecodeError):
+    except (IOError, json.JSONDecodeError) as e:
+        if strict:
+            print(f"Файл {USER_DATA_FILE} поврежден или не читается ({e}), запись отменена.")
+            return None
         # Если файл поврежден или не может быть прочитан, считаем его пустым
         return {}
 
+def _iter_all_data():
+    """
+    Потоково читает JSON-файл пользователей и выдает пары (ключ, данные) по одной,
+    не загружая файл целиком: в памяти одновременно находятся только блок
+    ITER_CHUNK_SIZE и текущая запись. Поврежденный или нечитаемый файл,
+    как и в _load_all_data, считается пустым (уже выданные записи остаются выданными).
+    """
+    if not os.path.exists(USER_DATA_FILE):
+        return
+    decoder = json.JSONDecoder()
+    try:
+        with open(USER_DATA_FILE, "r", encoding="utf-8") as f:
+            buffer, pos, eof = "", 0, False
+
+            def next_token(expected: str | None = None):
+                """Пропускает пробелы и возвращает следующий символ (дочитывая файл при необходимости)."""
+                nonlocal buffer, pos, eof
+                while True:
+                    while pos < len(buffer) and buffer[pos].isspace():
+                        pos += 1
+                    if pos < len(buffer) or eof:
+                        break
+                    buffer, pos = f.read(ITER_CHUNK_SIZE), 0
+                    eof = not buffer
+                char = buffer[pos] if pos < len(buffer) else ""
+                if expected is not None:
+                    if not char or char not in expected:
+                        raise json.JSONDecodeError(f"Ожидался один из символов {expected!r}", buffer, pos)
+                    pos += 1
+                return char
+
+            def next_value():
+                """Разбирает следующее JSON-значение, дочитывая файл, пока значение не завершится."""
+                nonlocal buffer, pos, eof
+                next_token()
+                while True:
+                    try:
+                        value, end = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if eof:
+                            raise
+                    else:
+                        # Число у границы блока могло прочитаться не полностью
+                        if end < len(buffer) or eof:
+                            pos = end
+                            return value
+                    chunk = f.read(ITER_CHUNK_SIZE)
+                    buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+
+            if next_token() == "":
+                return
+            next_token("{")
+            if next_token() == "}":
+                return
+            while True:
+                key = next_value()
+                next_token(":")
+                value = next_value()
+                # Запись выдается только вместе с разделителем после нее: в обрезанном
+                # файле последнее значение (например, число) могло разобраться не целиком
+                last = next_token(",}") == "}"
+                yield key, value
+                if last:
+                    return
+    except (IOError, json.JSONDecodeError) as e:
+        print(f"Ошибка при чтении {USER_DATA_FILE}: {e}")
+
+def _write_all_data(all_data: dict) -> bool:
+    """
+    Атомарно записывает данные всех пользователей: во временный файл рядом
+    с USER_DATA_FILE, который затем заменяет исходный через os.replace.
+    Читатели видят либо старый, либо новый файл целиком, но не записанный наполовину.
+    Returns:
+        True, если данные записаны.
+    """
+    directory = os.path.dirname(os.path.abspath(USER_DATA_FILE))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".User_Data.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(all_data, f, ensure_ascii=False, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, USER_DATA_FILE)
+    except (IOError, OSError) as e:
+        print(f"Ошибка при записи {USER_DATA_FILE}: {e}")
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+        return False
+    return True
+
+class _JsonBackend:
+    """Хранение всех пользователей в одном JSON-файле (исходный формат)."""
+
+    def __init__(self):
+        # Чтение, изменение и запись файла - одна операция для всех потоков процесса
+        self._write_lock = threading.Lock()
+
+    def load(self, user_id: int) -> dict:
+        return _load_all_data().get(str(user_id), {})
+
+    def load_many(self, user_ids) -> dict:
+        # Один проход по файлу, в памяти остаются только нужные записи
+        wanted = {str(user_id): user_id for user_id in user_ids}
+        result = {user_id: {} for user_id in wanted.values()}
+        for key, data in _iter_all_data():
+            if key in wanted:
+                result[wanted[key]] = data
+        return result
+
+    def iter_all(self):
+        for key, data in _iter_all_data():
+            yield int(key), data
+
+    def due_all(self):
+        for key, data in _iter_all_data():
+            due = next_due_at(data)
+            if due is not None:
+                yield int(key), due
+
+    def save(self, user_id: int, data: dict) -> None:
+        self.save_many({user_id: data})
+
+    def save_many(self, users: dict) -> bool:
+        with self._write_lock:
+            all_data = _load_all_data(strict=True)
+            if all_data is None:
+                return False
+            # Ключи в JSON должны быть строками
+            for user_id, data in users.items():
+                all_data[str(user_id)] = data
+            return _write_all_data(all_data)
+
+    def update_many(self, patches: dict) -> bool:
+        with self._write_lock:
+            all_data = _load_all_data(strict=True)
+            if all_data is None:
+                return False
+            for user_id, (patch, record) in patches.items():
+                stored = all_data.get(str(user_id))
+                if stored is None:
+                    all_data[str(user_id)] = record
+                    continue
+                for path, value in patch.items():
+                    _set_path(stored, path, value)
+            return _write_all_data(all_data)
+
+    def load_all(self) -> dict:
+        return {int(user_id): data for user_id, data in _load_all_data().items()}
+
+class _SqliteBackend:
+    """
+    Хранение пользователей в SQLite: одна строка на пользователя,
+    поиск по первичному ключу user_id, журнал в режиме WAL.
+    """
+
+    def __init__(self, path: str):
+        # Соединение общее для всех потоков TeleBot, поэтому доступ к нему под замком.
+        # Параметризованные запросы кэшируются sqlite3 как подготовленные выражения.
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(_SQL_CREATE_TABLE)
+            self._add_due_column()
+            self._conn.execute(_SQL_CREATE_DUE_INDEX)
+            if self._conn.execute(_SQL_COUNT_USERS).fetchone()[0] == 0:
+                self._import_json()
+
+    def _add_due_column(self) -> None:
+        """Добавляет столбец next_due_at в базу, созданную до его появления, и заполняет его."""
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(users)")]
+        if "next_due_at" in columns:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.execute("ALTER TABLE users ADD COLUMN next_due_at REAL")
+        rows = []
+        for user_id, raw in self._conn.execute(_SQL_SELECT_ALL).fetchall():
+            try:
+                due = next_due_at(json.loads(raw))
+            except json.JSONDecodeError:
+                continue
+            if due is not None:
+                rows.append((due, user_id))
+        self._conn.executemany(_SQL_SET_DUE, rows)
+        self._conn.execute("COMMIT")
+
+    def _import_json(self) -> None:
+        """Переносит пользователей из JSON-файла при первом запуске на SQLite."""
+        rows = [
+            (int(user_id), json.dumps(data, ensure_ascii=False), next_due_at(data))
+            for user_id, data in _load_all_data().items()
+        ]
+        if rows:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(_SQL_UPSERT_USER, rows)
+            self._conn.execute("COMMIT")
+
+    def load(self, user_id: int) -> dict:
+        try:
+            with self._lock:
+                row = self._conn.execute(_SQL_SELECT_USER, (user_id,)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке данных пользователя {user_id}: {e}")
+            return {}
+        if row is None:
+            return {}
+        try:
+            return json.loads(row[0])
+        except json.JSONDecodeError:
+            return {}
+
+    def load_many(self, user_ids) -> dict:
+        user_ids = list(user_ids)
+        result = {user_id: {} for user_id in user_ids}
+        try:
+            for i in range(0, len(user_ids), ITER_BATCH_SIZE):
+                batch = user_ids[i:i + ITER_BATCH_SIZE]
+                sql = f"SELECT user_id, data FROM users WHERE user_id IN ({', '.join('?' * len(batch))})"
+                with self._lock:
+                    rows = self._conn.execute(sql, batch).fetchall()
+                for user_id, raw in rows:
+                    try:
+                        result[user_id] = json.loads(raw)
+                    except json.JSONDecodeError:
+                        continue
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке данных пользователей {user_ids}: {e}")
+        return result
+
+    def iter_all(self):
+        # Постранично по первичному ключу: замок соединения не удерживается между пачками
+        last_id = -1
+        while True:
+            try:
+                with self._lock:
+                    rows = self._conn.execute(_SQL_SELECT_PAGE, (last_id, ITER_BATCH_SIZE)).fetchall()
+            except sqlite3.Error as e:
+                print(f"Ошибка при загрузке данных пользователей: {e}")
+                return
+            for user_id, raw in rows:
+                try:
+                    data = json.loads(raw)
+                except json.JSONDecodeError:
+                    continue
+                yield user_id, data
+            if len(rows) < ITER_BATCH_SIZE:
+                return
+            last_id = rows[-1][0]
+
+    def due_all(self):
+        # Только подписчики - по частичному индексу users_next_due_at
+        try:
+            with self._lock:
+                return self._conn.execute(_SQL_SELECT_DUE).fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке сроков уведомлений: {e}")
+            return None
+
+    def save(self, user_id: int, data: dict) -> None:
+        self.save_many({user_id: data})
+
+    def save_many(self, users: dict) -> bool:
+        rows = [
+            (user_id, json.dumps(data, ensure_ascii=False), next_due_at(data))
+            for user_id, data in users.items()
+        ]
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    self._conn.executemany(_SQL_UPSERT_USER, rows)
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении данных пользователей {list(users)}: {e}")
+            return False
+        return True
+
+    def update_many(self, patches: dict) -> bool:
+        # Изменения полей применяются в самой базе через json_set одним UPDATE на строку;
+        # пользователя, которого в базе еще нет, вставляем целиком
+        try:
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    for user_id, (patch, record) in patches.items():
+                        # Вложенные json_set, а не один с несколькими путями: внутри одного вызова
+                        # SQLite не видит только что записанные объекты по более глубоким путям
+                        expr, args = "data", []
+                        for path, value in patch.items():
+                            expr = f"json_set({expr}, ?, json(?))"
+                            args += [_json_path(path), json.dumps(value, ensure_ascii=False)]
+                        # Срок уведомления считаем по записи целиком, она уже содержит изменения
+                        due = next_due_at(record)
+                        sql = f"UPDATE users SET data = {expr}, next_due_at = ? WHERE user_id = ?"
+                        if self._conn.execute(sql, (*args, due, user_id)).rowcount == 0:
+                            self._conn.execute(
+                                _SQL_UPSERT_USER, (user_id, json.dumps(record, ensure_ascii=False), due)
+                            )
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                self._conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Ошибка при сохранении данных пользователей {list(patches)}: {e}")
+            return False
+        return True
+
+    def load_all(self) -> dict:
+        try:
+            with self._lock:
+                rows = self._conn.execute(_SQL_SELECT_ALL).fetchall()
+        except sqlite3.Error as e:
+            print(f"Ошибка при загрузке данных пользователей: {e}")
+            return {}
+        result = {}
+        for user_id, raw in rows:
+            try:
+                result[user_id] = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+        return result
+
+def _create_backend(name: str):
+    """Создает движок хранения по названию из настройки STORAGE_BACKEND."""
+    if name == "sqlite":
+        return _SqliteBackend(USER_DB_FILE)
+    if name != "json":
+        print(f"Неизвестный STORAGE_BACKEND '{name}', используется json.")
+    return _JsonBackend()
+
+_backend = _create_backend(STORAGE_BACKEND)
+
+# Кэш записей пользователей в памяти процесса (write-back): user_id -> данные.
+# Записи, сохраненные целиком, помечаются в _dirty, измененные по полям -
+# в _patches (user_id -> {путь ключей: значение}); фоновый поток записывает их
+# в хранилище раз в USER_FLUSH_INTERVAL_MS. Записи в кэше не изменяются на месте,
+# а заменяются новыми словарями, поэтому их можно записывать вне замка.
+_users = {}
+_dirty = set()
+_patches = {}
+_users_lock = threading.Lock()
+# Не дает двум сбросам писать в хранилище одновременно
+_flush_lock = threading.Lock()
+_flusher_started = False
+# Замки чтения-изменения-записи отдельных пользователей: user_id -> RLock
+_user_locks = {}
+# Индекс сроков уведомлений: отсортированный список (срок, user_id) и срок каждого
+# подписчика. Строится при первом запросе (в SQLite - по индексированному столбцу
+# next_due_at, для JSON - одним проходом по файлу) и дальше обновляется в save_user
+# и update_user, поэтому запросы к нему не ждут сброса изменений в хранилище.
+_due_index = None
+_due_of = {}
+_due_lock = threading.Lock()
+
+def user_lock(user_id: int) -> threading.RLock:
+    """
+    Возвращает замок пользователя. Последовательность load_user -> изменение ->
+    save_user, выполненная под ним, не теряет параллельные изменения этого
+    пользователя из других потоков (update_user и save_user берут тот же замок).
+    Пример:
+        with storage.user_lock(user_id):
+            data = storage.load_user(user_id)
+            ...
+            storage.save_user(user_id, data)
+    """
+    with _users_lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.RLock()
+    return lock
+
+def _set_due(user_id: int, due: float | None) -> None:
+    """Записывает срок пользователя в индекс. Вызывается под _due_lock."""
+    old = _due_of.pop(user_id, None)
+    if old is not None:
+        del _due_index[bisect.bisect_left(_due_index, (old, user_id))]
+    if due is not None:
+        _due_of[user_id] = due
+        bisect.insort(_due_index, (due, user_id))
+
+def _index_due(user_id: int, data: dict) -> None:
+    """Обновляет срок пользователя в индексе после изменения его записи."""
+    with _due_lock:
+        if _due_index is not None:
+            _set_due(user_id, next_due_at(data))
+
+def _ensure_due_index() -> bool:
+    """
+    Строит индекс сроков, если его еще нет. Вызывается под _due_lock.
+    Returns:
+        True, если индекс построен.
+    """
+    global _due_index
+    if _due_index is not None:
+        return True
+    # Под _flush_lock: записи, которые сейчас сбрасываются, иначе не видны ни в хранилище, ни в _dirty
+    with _flush_lock:
+        rows = _backend.due_all()
+        if rows is None:
+            return False
+        due_of = dict(rows)
+        with _users_lock:
+            pending = {user_id: _users[user_id] for user_id in _dirty | _patches.keys()}
+    for user_id, data in pending.items():
+        due = next_due_at(data)
+        if due is None:
+            due_of.pop(user_id, None)
+        else:
+            due_of[user_id] = due
+    _due_of.clear()
+    _due_of.update(due_of)
+    _due_index = sorted((due, user_id) for user_id, due in due_of.items())
+    return True
+
+def _ensure_flusher():
+    """Запускает фоновый поток записи при первом сохранении. Вызывается под _users_lock."""
+    global _flusher_started
+    if not _flusher_started:
+        _flusher_started = True
+        threading.Thread(target=_flush_loop, name="user-storage-flusher", daemon=True).start()
+
+def _flush_loop():
+    """Периодически записывает измененных пользователей в хранилище."""
+    while True:
+        time.sleep(USER_FLUSH_INTERVAL_MS / 1000)
+        flush()
+
+def flush() -> None:
+    """
+    Записывает в хранилище все измененные с последнего сброса записи пользователей.
+    Вызывается фоновым потоком и обязательно при остановке бота.
+    """
+    with _flush_lock:
+        with _users_lock:
+            if not (_dirty or _patches):
+                return
+            pending = {user_id: _users[user_id] for user_id in _dirty}
+            patches = {user_id: (patch, _users[user_id]) for user_id, patch in _patches.items()}
+            _dirty.clear()
+            _patches.clear()
+        failed = set()
+        if pending and not _backend.save_many(pending):
+            failed.update(pending)
+        if patches and not _backend.update_many(patches):
+            failed.update(patches)
+        if failed:
+            # Не записали - запишем эти записи целиком при следующем сбросе
+            with _users_lock:
+                _dirty.update(failed)
+                for user_id in failed:
+                    _patches.pop(user_id, None)
+
+atexit.register(flush)
+
 def save_user(user_id: int, data: dict) -> None:
     """
-    Сохраняет или обновляет данные пользователя в JSON-файле.
+    Сохраняет или обновляет данные пользователя в выбранном хранилище.
+    Запись сразу видна load_user, а в хранилище попадает при ближайшем сбросе (flush).
 
     Args:
         user_id (int): Идентификатор пользователя.
         data (dict): Словарь с данными пользователя для сохранения.
     """
-    all_data = _load_all_data()
-    # Ключи в JSON должны быть строками
-    all_data[str(user_id)] = data
-    try:
-        with open(USER_DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(all_data, f, ensure_ascii=False, indent=4)
-    except IOError as e:
-        print(f"Ошибка при сохранении данных пользователя {user_id}: {e}")
+    data = copy.deepcopy(data)
+    with user_lock(user_id):
+        with _users_lock:
+            _users[user_id] = data
+            _dirty.add(user_id)
+            _patches.pop(user_id, None)
+            _ensure_flusher()
+        _index_due(user_id, data)
+
+def save_users(users: dict) -> None:
+    """
+    Сохраняет данные нескольких пользователей. Как и save_user, записи сразу
+    видны load_user, а в хранилище попадают при ближайшем сбросе - все вместе
+    одной операцией (для JSON - одной перезаписью файла): пачка помечается
+    измененной целиком, поэтому сброс не может записать ее частично.
+
+    Args:
+        users (dict): Словарь {user_id (int): данные пользователя}.
+    """
+    users = {user_id: copy.deepcopy(data) for user_id, data in users.items()}
+    with contextlib.ExitStack() as stack:
+        # Замки пользователей берутся в одном порядке, чтобы параллельные пачки не ждали друг друга по кругу
+        for user_id in sorted(users):
+            stack.enter_context(user_lock(user_id))
+        with _users_lock:
+            _users.update(users)
+            _dirty.update(users)
+            for user_id in users:
+                _patches.pop(user_id, None)
+            _ensure_flusher()
+        for user_id, data in users.items():
+            _index_due(user_id, data)
+
+def _cached(user_id: int) -> dict:
+    """Возвращает запись из кэша (без копирования), при необходимости загрузив ее из хранилища."""
+    with _users_lock:
+        data = _users.get(user_id)
+    if data is None:
+        loaded = _backend.load(user_id)
+        with _users_lock:
+            # Пока читали хранилище, запись могли сохранить - она новее прочитанной
+            data = _users.setdefault(user_id, loaded)
+    return data
+
+def _cached_many(user_ids) -> dict:
+    """Как _cached для нескольких пользователей: отсутствующих в кэше загружает одним обращением к хранилищу."""
+    with _users_lock:
+        found = {user_id: _users[user_id] for user_id in user_ids if user_id in _users}
+    missing = [user_id for user_id in user_ids if user_id not in found]
+    if missing:
+        loaded = _backend.load_many(missing)
+        with _users_lock:
+            for user_id in missing:
+                found[user_id] = _users.setdefault(user_id, loaded.get(user_id, {}))
+    return found
+
+def update_user(user_id: int, **fields) -> dict:
+    """
+    Атомарно изменяет отдельные поля данных пользователя, не перезаписывая остальные.
+    Одновременные изменения из разных потоков не теряются. В хранилище попадают
+    только измененные поля (в SQLite - одним UPDATE через json_set).
+
+    Пример: update_user(user_id, notifications__enabled=lambda enabled: not enabled, city="Москва")
+
+    Args:
+        user_id (int): Идентификатор пользователя.
+        **fields: Новые значения полей. Вложенные поля задаются путем через "__"
+            (или через "." при передаче словарем: **{"notifications.enabled": True}).
+            Если значение вызываемое, оно получает текущее значение поля (или None)
+            и возвращает новое.
+
+    Returns:
+        dict: Копия данных пользователя после изменения.
+    """
+    if not fields:
+        return load_user(user_id)
+    with user_lock(user_id):
+        data = copy.deepcopy(_cached(user_id))
+        changes = []
+        for field, value in fields.items():
+            path = _split_path(field)
+            if callable(value):
+                value = value(_get_path(data, path))
+            _set_path(data, path, value)
+            changes.append((path, copy.deepcopy(value)))
+        with _users_lock:
+            _users[user_id] = data
+            if user_id not in _dirty:
+                patch = _patches.setdefault(user_id, {})
+                for path, value in changes:
+                    # Более раннее изменение этого поля или вложенных в него уже не нужно,
+                    # а новое должно применяться после изменений объемлющих полей
+                    for pending_path in [p for p in patch if p[:len(path)] == path]:
+                        del patch[pending_path]
+                    patch[path] = value
+            _ensure_flusher()
+        _index_due(user_id, data)
+        return copy.deepcopy(data)
 
 def load_user(user_id: int) -> dict:
     """
-    Загружает данные пользователя из JSON-файла.
+    Загружает данные пользователя из кэша в памяти или из выбранного хранилища.
 
     Args:
         user_id (int): Идентификатор пользователя.
 
     Returns:
         dict: Словарь с данными пользователя или пустой словарь, если пользователь не найден.
+            Это копия: изменения нужно сохранить через save_user.
+    """
+    return copy.deepcopy(_cached(user_id))
+
+def load_users(user_ids) -> dict:
+    """
+    Загружает данные нескольких пользователей. Тех, кого нет в кэше, читает
+    из хранилища одним обращением (для JSON - одним проходом по файлу).
+
+    Args:
+        user_ids: Идентификаторы пользователей.
+
+    Returns:
+        dict: Словарь {user_id (int): данные пользователя}; для ненайденных - пустой словарь.
+            Это копии: изменения нужно сохранить через save_user или save_users.
+    """
+    return {user_id: copy.deepcopy(data) for user_id, data in _cached_many(list(user_ids)).items()}
+
+def iter_users():
+    """
+    Перебирает всех пользователей, не загружая их в память разом: записи
+    читаются из хранилища потоково (JSON-файл - блоками, SQLite - пачками строк),
+    еще не записанные изменения берутся из кэша. В отличие от load_all_users,
+    подходит для пакетных задач по всей базе (рассылки, прогрев кэша, экспорт).
+
+    Yields:
+        tuple: Пары (user_id (int), данные пользователя). Данные - копии.
+    """
+    flush()
+    # Не записанные сбросом (например, из-за ошибки) записи есть только в кэше
+    with _users_lock:
+        pending = _dirty | _patches.keys()
+    for user_id, data in _backend.iter_all():
+        with _users_lock:
+            if user_id in _dirty or user_id in _patches:
+                data = copy.deepcopy(_users[user_id])
+        pending.discard(user_id)
+        yield user_id, data
+    for user_id in pending:
+        with _users_lock:
+            data = _users[user_id]
+        yield user_id, copy.deepcopy(data)
+
+def load_all_users() -> dict:
+    """
+    Загружает данные всех пользователей из выбранного хранилища
+    с учетом еще не записанных изменений.
+
+    Returns:
+        dict: Словарь {user_id (int): данные пользователя}.
+    """
+    # Под _flush_lock: иначе записи, которые сейчас сбрасываются, не видны ни в хранилище, ни в _dirty
+    with _flush_lock:
+        users = _backend.load_all()
+        with _users_lock:
+            users.update({user_id: copy.deepcopy(_users[user_id]) for user_id in _dirty | _patches.keys()})
+    return users
+
+def due_users(now: float, limit: int) -> dict:
+    """
+    Возвращает пользователей, которым пора отправить уведомление, по индексу
+    сроков без перебора всех пользователей. Индекс учитывает и еще не записанные
+    в хранилище изменения.
+
+    Args:
+        now (float): Текущее Unix-время.
+        limit (int): Максимальное число пользователей в ответе.
+
+    Returns:
+        dict: {user_id (int): данные пользователя} для самых ранних сроков не позже now.
+    """
+    with _due_lock:
+        if not _ensure_due_index():
+            return {}
+        end = min(bisect.bisect_right(_due_index, (now, math.inf)), limit)
+        user_ids = [user_id for _, user_id in _due_index[:end]]
+    return {user_id: copy.deepcopy(data) for user_id, data in _cached_many(user_ids).items()}
+
+def next_due_time() -> float | None:
+    """
+    Returns:
+        float | None: Ближайший срок уведомления среди всех пользователей
+            или None, если уведомления никому не нужны.
     """
-    all_data = _load_all_data()
-    return all_data.get(str(user_id), {})
+    with _due_lock:
+        if not _ensure_due_index():
+            return None
+        return _due_index[0][0] if _due_index else None
 
 # Пример использования (можно раскомментировать для проверки)
 # if __name__ == '__main__':
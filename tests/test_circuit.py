@@ -0,0 +1,86 @@
+"""
+Тесты выключателя (circuit.CircuitBreaker): размыкание по доле неудач,
+пробный запрос в полуоткрытом состоянии и замыкание после удачной пробы.
+
+Время выключателя подменяется, поэтому тесты не ждут reset_timeout_s.
+"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import circuit  # noqa: E402
+import metrics  # noqa: E402
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(circuit.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuit.CircuitBreaker("Test", failure_rate=0.5, window_s=60, min_calls=4,
+                                              reset_timeout_s=30)
+
+    def trip(self):
+        for _ in range(4):
+            self.breaker.record_failure()
+
+    def test_opens_at_failure_rate(self):
+        self.breaker.record_success()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit.STATE_CLOSED)
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit.STATE_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(metrics.snapshot()['circuit_breaker_state{upstream="Test"}'], 1)
+
+    def test_too_few_calls_do_not_trip(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertTrue(self.breaker.allow())
+
+    def test_failures_outside_window_are_forgotten(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 61
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit.STATE_CLOSED)
+
+    def test_half_open_allows_single_probe(self):
+        self.trip()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, circuit.STATE_HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        # Результат пробы так и не записан: через reset_timeout_s пропускается следующая
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+
+    def test_successful_probe_closes(self):
+        self.trip()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, circuit.STATE_CLOSED)
+        self.assertTrue(self.breaker.allow())
+        # После замыкания окно начинается заново
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit.STATE_CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.trip()
+        self.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, circuit.STATE_OPEN)
+        self.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.now += 1
+        self.assertTrue(self.breaker.allow())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+Тесты офлайн-геокодера (geocoder.PlaceIndex): поиск через антимеридиан
+и полюс и совпадение с полным перебором.
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import geocoder  # noqa: E402
+
+class NearestTest(unittest.TestCase):
+    def test_across_antimeridian(self):
+        index = geocoder.PlaceIndex()
+        index.add(65.0, 180.0, "Восток", "RU")
+        index.add(-17.0, -179.9, "Запад", "FJ")
+        self.assertEqual(index.nearest(65.0, -179.9), ("Восток", "RU"))
+        self.assertEqual(index.nearest(65.0, 179.9), ("Восток", "RU"))
+        self.assertEqual(index.nearest(-17.0, 179.9), ("Запад", "FJ"))
+
+    def test_across_pole(self):
+        index = geocoder.PlaceIndex()
+        # Через полюс до станции около 44 км, хотя долготы отличаются на 180°
+        index.add(89.8, 180.0, "Станция", "XX")
+        index.add(-89.9, 90.0, "Юг", "AQ")
+        self.assertEqual(index.nearest(89.8, 0.0), ("Станция", "XX"))
+        self.assertEqual(index.nearest(-89.9, -90.0), ("Юг", "AQ"))
+        self.assertIsNone(index.nearest(89.0, 0.0))
+
+    def test_matches_brute_force(self):
+        rng = random.Random(1)
+        index = geocoder.PlaceIndex()
+        places = []
+        for i in range(2000):
+            lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+            places.append((lat, lon, str(i)))
+            index.add(lat, lon, str(i), "XX")
+        for _ in range(300):
+            # Половина точек - у полюсов, где ячейки сетки сильнее всего искажены
+            lat = rng.uniform(-90, 90) if rng.random() < 0.5 else rng.choice((1, -1)) * rng.uniform(80, 90)
+            lon = rng.uniform(-180, 180)
+            distance, name = min((geocoder.haversine_km(lat, lon, p_lat, p_lon), name)
+                                 for p_lat, p_lon, name in places)
+            expected = (name, "XX") if distance <= geocoder.MAX_DISTANCE_KM else None
+            with self.subTest(lat=lat, lon=lon):
+                self.assertEqual(index.nearest(lat, lon), expected)
+
+if __name__ == "__main__":
+    unittest.main()
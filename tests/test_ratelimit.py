@@ -0,0 +1,89 @@
+"""
+Тесты ограничителя запросов (ratelimit.TokenBucket): резерв токенов
+для интерактивных запросов, их приоритет над фоновыми и таймауты ожидания.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ratelimit  # noqa: E402
+
+class ReserveTest(unittest.TestCase):
+    def setUp(self):
+        # Время остановлено: ведро не пополняется
+        patcher = mock.patch.object(ratelimit.time, "monotonic", return_value=1000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_background_leaves_reserve(self):
+        bucket = ratelimit.TokenBucket(60, burst=4, background_reserve=2)
+        background = ratelimit.PRIORITY_BACKGROUND
+        interactive = ratelimit.PRIORITY_INTERACTIVE
+        self.assertTrue(bucket.acquire(background, timeout=0))
+        self.assertTrue(bucket.acquire(background, timeout=0))
+        self.assertFalse(bucket.acquire(background, timeout=0))
+        self.assertTrue(bucket.acquire(interactive, timeout=0))
+        self.assertTrue(bucket.acquire(interactive, timeout=0))
+        self.assertFalse(bucket.acquire(interactive, timeout=0))
+
+    def test_priority_from_context(self):
+        bucket = ratelimit.TokenBucket(60, burst=2, background_reserve=1)
+        with ratelimit.background():
+            self.assertTrue(bucket.acquire(timeout=0))
+            self.assertFalse(bucket.acquire(timeout=0))
+        self.assertTrue(bucket.acquire(timeout=0))
+
+class PreemptionTest(unittest.TestCase):
+    def empty_bucket(self) -> ratelimit.TokenBucket:
+        # Один токен в 0,1 с, без резерва: фоновые и интерактивные запросы отличает только очередь
+        bucket = ratelimit.TokenBucket(601, burst=1, background_reserve=0)
+        self.assertTrue(bucket.acquire(timeout=0))
+        return bucket
+
+    def test_interactive_overtakes_waiting_background(self):
+        bucket = self.empty_bucket()
+        order = []
+
+        def take(priority):
+            if bucket.acquire(priority, timeout=5):
+                order.append(priority)
+
+        threads = [threading.Thread(target=take, args=(ratelimit.PRIORITY_BACKGROUND,)),
+                   threading.Thread(target=take, args=(ratelimit.PRIORITY_INTERACTIVE,))]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [ratelimit.PRIORITY_INTERACTIVE, ratelimit.PRIORITY_BACKGROUND])
+
+    def test_async_interactive_overtakes_waiting_background(self):
+        bucket = self.empty_bucket()
+        order = []
+
+        async def take(priority):
+            if await bucket.acquire_async(priority, timeout=5):
+                order.append(priority)
+
+        async def run():
+            background = asyncio.create_task(take(ratelimit.PRIORITY_BACKGROUND))
+            await asyncio.sleep(0.02)
+            await asyncio.gather(background, take(ratelimit.PRIORITY_INTERACTIVE))
+
+        asyncio.run(run())
+        self.assertEqual(order, [ratelimit.PRIORITY_INTERACTIVE, ratelimit.PRIORITY_BACKGROUND])
+
+    def test_timeout(self):
+        bucket = self.empty_bucket()
+        start = time.monotonic()
+        self.assertFalse(bucket.acquire(timeout=0.03))
+        self.assertLess(time.monotonic() - start, 0.09)
+        self.assertFalse(asyncio.run(bucket.acquire_async(timeout=0.03)))
+
+if __name__ == "__main__":
+    unittest.main()
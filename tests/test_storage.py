@@ -0,0 +1,174 @@
+"""
+Тесты хранилища пользователей: изменения полей через update_user и их запись
+в оба движка, повтор записи после неудачного сброса, атомарная замена
+JSON-файла и потоковое чтение файла (_iter_all_data).
+
+Запуск из корня репозитория:
+    python -m pytest tests
+    python -m unittest discover tests
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import storage  # noqa: E402
+
+class StorageTestCase(unittest.TestCase):
+    """Каждый тест работает с чистым кэшем и JSON-файлом во временном каталоге."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patches = [
+            mock.patch.object(storage, "USER_DATA_FILE", os.path.join(self.tmp.name, "User_Data.json")),
+            mock.patch.object(storage, "_backend", storage._JsonBackend()),
+            mock.patch.object(storage, "_users", {}),
+            mock.patch.object(storage, "_dirty", set()),
+            mock.patch.object(storage, "_patches", {}),
+            mock.patch.object(storage, "_user_locks", {}),
+            mock.patch.object(storage, "_due_index", None),
+            mock.patch.object(storage, "_due_of", {}),
+            # Сбросы выполняет сам тест, фоновый поток записи не запускается
+            mock.patch.object(storage, "_flusher_started", True),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.tmp.cleanup)
+
+    def use_sqlite(self):
+        backend = storage._SqliteBackend(os.path.join(self.tmp.name, "User_Data.db"))
+        self.addCleanup(backend._conn.close)
+        patcher = mock.patch.object(storage, "_backend", backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read_file(self) -> dict:
+        with open(storage.USER_DATA_FILE, encoding="utf-8") as f:
+            return json.load(f)
+
+class UpdateUserTest(StorageTestCase):
+    def apply_updates(self):
+        storage.save_user(1, {"city": "Москва", "notifications": {"enabled": True, "interval_h": 3}})
+        storage.flush()
+        storage.update_user(1, notifications__interval_h=6)
+        # Замена объемлющего поля отменяет более раннее изменение вложенного...
+        storage.update_user(1, notifications={"enabled": False})
+        # ...а следующее изменение вложенного применяется уже поверх замены
+        storage.update_user(1, notifications__interval_h=12, city="Тверь")
+        storage.update_user(2, **{"notifications.enabled": True})
+        return {
+            1: {"city": "Тверь", "notifications": {"enabled": False, "interval_h": 12}},
+            2: {"notifications": {"enabled": True}},
+        }
+
+    def test_patch_order_json(self):
+        expected = self.apply_updates()
+        self.assertEqual(storage.load_user(1), expected[1])
+        storage.flush()
+        self.assertEqual(self.read_file(), {str(user_id): data for user_id, data in expected.items()})
+
+    def test_patch_order_sqlite(self):
+        self.use_sqlite()
+        expected = self.apply_updates()
+        storage.flush()
+        self.assertEqual(storage._backend.load_all(), expected)
+
+    def test_callable_updates_are_not_lost(self):
+        storage.save_user(1, {"count": 0})
+
+        def increment():
+            for _ in range(200):
+                storage.update_user(1, count=lambda count: count + 1)
+
+        threads = [threading.Thread(target=increment) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        storage.flush()
+        self.assertEqual(self.read_file()["1"]["count"], 1600)
+
+    def test_failed_flush_is_retried_with_full_record(self):
+        storage.save_user(1, {"city": "Москва", "lat": 1})
+        storage.flush()
+        storage.update_user(1, city="Тверь")
+        with mock.patch.object(storage._backend, "update_many", return_value=False):
+            storage.flush()
+        self.assertEqual(self.read_file()["1"]["city"], "Москва")
+        # Неудачно записанное изменение остается в кэше и записывается следующим сбросом
+        self.assertIn(1, storage._dirty)
+        storage.update_user(1, lat=2)
+        storage.flush()
+        self.assertEqual(self.read_file()["1"], {"city": "Тверь", "lat": 2})
+        self.assertFalse(storage._dirty or storage._patches)
+
+class AtomicWriteTest(StorageTestCase):
+    def tmp_files(self) -> list:
+        return [name for name in os.listdir(self.tmp.name) if name.endswith(".tmp")]
+
+    def test_failed_replace_keeps_old_file(self):
+        storage._write_all_data({"1": {"city": "Москва"}})
+        with mock.patch.object(storage.os, "replace", side_effect=OSError("disk full")):
+            self.assertFalse(storage._write_all_data({"1": {"city": "Тверь"}}))
+        self.assertEqual(self.read_file(), {"1": {"city": "Москва"}})
+        self.assertEqual(self.tmp_files(), [])
+
+    def test_corrupted_file_is_not_overwritten(self):
+        with open(storage.USER_DATA_FILE, "w", encoding="utf-8") as f:
+            f.write('{"1": {"city": ')
+        self.assertFalse(storage._backend.save_many({2: {"city": "Тверь"}}))
+        with open(storage.USER_DATA_FILE, encoding="utf-8") as f:
+            self.assertEqual(f.read(), '{"1": {"city": ')
+
+class IterAllDataTest(StorageTestCase):
+    USERS = {
+        "1": {"city": "Москва", "lat": 55.7558, "lon": 37.6176, "notifications": {"enabled": True}},
+        "22": {"city": "Город \"в кавычках\" {}", "n": [1, -2.5e-3, None, False], "empty": {}},
+        "333": {"city": "", "big": 12345678901234567890},
+    }
+
+    def write(self, text: str):
+        with open(storage.USER_DATA_FILE, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def test_every_chunk_boundary(self):
+        for indent in (None, 4):
+            self.write(json.dumps(self.USERS, ensure_ascii=False, indent=indent))
+            for chunk_size in range(1, 40):
+                with self.subTest(indent=indent, chunk_size=chunk_size), \
+                        mock.patch.object(storage, "ITER_CHUNK_SIZE", chunk_size):
+                    self.assertEqual(dict(storage._iter_all_data()), self.USERS)
+
+    def test_empty_files(self):
+        for text in ("", "  \n", "{}", " { } "):
+            with self.subTest(text=text):
+                self.write(text)
+                self.assertEqual(list(storage._iter_all_data()), [])
+
+    def test_truncated_file_yields_complete_records(self):
+        text = json.dumps(self.USERS, ensure_ascii=False)
+        second_end = text.index('"333"')
+        # Обрезано внутри записи, внутри числа последней записи и перед закрывающей скобкой
+        for cut in (1, second_end - 3, second_end + 5, len(text) - 5, len(text) - 1):
+            with self.subTest(cut=cut), mock.patch.object(storage, "ITER_CHUNK_SIZE", 7):
+                self.write(text[:cut])
+                records = dict(storage._iter_all_data())
+                self.assertNotIn("333", records)
+                self.assertEqual(records, {key: self.USERS[key] for key in records})
+
+    def test_iter_users_overlays_unflushed_changes(self):
+        self.write(json.dumps(self.USERS, ensure_ascii=False))
+        with mock.patch.object(storage._backend, "save_many", return_value=False):
+            storage.save_user(4, {"city": "Тверь"})
+            users = dict(storage.iter_users())
+        self.assertEqual(users[4], {"city": "Тверь"})
+        self.assertEqual(users[22], self.USERS["22"])
+        self.assertEqual(len(users), 4)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Тесты клиентов погоды: объединение одинаковых запросов (single-flight)
+в weather_app и async_weather и отрицательный кэш ответа 404.
+
+Кэш и псевдонимы городов для каждого теста свои, файлы - во временном
+каталоге; запросы к API подменяются.
+"""
+import asyncio
+import collections
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import async_weather  # noqa: E402
+import circuit  # noqa: E402
+import metrics  # noqa: E402
+import ratelimit  # noqa: E402
+import weather_app  # noqa: E402
+import weather_core as core  # noqa: E402
+
+WEATHER = {"id": 524901, "name": "Москва", "sys": {"country": "RU"}, "main": {"temp": 12.3}}
+
+class WeatherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.breaker = circuit.CircuitBreaker("OpenWeather-test")
+        patches = [
+            mock.patch.object(core, "CACHE_FILE", os.path.join(self.tmp.name, "weather_cache.json")),
+            mock.patch.object(core, "CITY_ALIASES_FILE", os.path.join(self.tmp.name, "city_aliases.json")),
+            mock.patch.object(core, "_cache", collections.OrderedDict()),
+            mock.patch.object(core, "_aliases", {}),
+            # Файлы кэша не читаются, фоновый поток записи не запускается
+            mock.patch.object(core, "_cache_loaded", True),
+            mock.patch.object(core, "_cache_dirty", False),
+            mock.patch.object(core, "_aliases_dirty", False),
+            mock.patch.object(core, "owm_breaker", self.breaker),
+            mock.patch.object(core, "owm_limiter", ratelimit.TokenBucket(10**6)),
+            mock.patch.object(weather_app, "_flights", {}),
+            mock.patch.object(weather_app, "_refreshing", set()),
+            mock.patch.object(async_weather, "_flights", {}),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def wait_followers(self, count: int, base: float, kind: str = "weather"):
+        """Ждет, пока count вызовов присоединятся к выполняющемуся запросу."""
+        name = f'weather_singleflight_deduplicated_total{{kind="{kind}"}}'
+        deadline = time.monotonic() + 5
+        while metrics.snapshot().get(name, 0) - base < count:
+            self.assertLess(time.monotonic(), deadline, "ожидающие вызовы не присоединились к запросу")
+            time.sleep(0.005)
+
+    def deduplicated(self, kind: str = "weather") -> float:
+        return metrics.snapshot().get(f'weather_singleflight_deduplicated_total{{kind="{kind}"}}', 0)
+
+class SingleFlightTest(WeatherTestCase):
+    def run_concurrently(self, fake_request, release: threading.Event, n: int = 8) -> list:
+        base = self.deduplicated()
+        with mock.patch.object(weather_app, "make_request", side_effect=fake_request), \
+                ThreadPoolExecutor(max_workers=n) as pool:
+            futures = [pool.submit(weather_app.get_weather_by_city, "Москва") for _ in range(n)]
+            self.wait_followers(n - 1, base)
+            release.set()
+            return [future.exception() or future.result() for future in futures]
+
+    def test_one_request_for_concurrent_callers(self):
+        release = threading.Event()
+        calls = []
+
+        def fake_request(url, params):
+            calls.append(params["q"])
+            release.wait(5)
+            return dict(WEATHER)
+
+        results = self.run_concurrently(fake_request, release)
+        self.assertEqual(calls, ["Москва"])
+        self.assertEqual(results, [WEATHER] * 8)
+        # Ответ закэширован, следующий вызов не обращается к API
+        with mock.patch.object(weather_app, "make_request") as request:
+            self.assertEqual(weather_app.get_weather_by_city("москва"), WEATHER)
+        request.assert_not_called()
+
+    def test_error_reaches_every_caller(self):
+        release = threading.Event()
+        calls = []
+
+        def fake_request(url, params):
+            calls.append(params["q"])
+            release.wait(5)
+            raise RuntimeError("boom")
+
+        results = self.run_concurrently(fake_request, release)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        for result in results:
+            self.assertIsInstance(result, RuntimeError)
+        self.assertEqual(weather_app._flights, {})
+
+    def test_interactive_caller_does_not_wait_for_background_leader(self):
+        core._update_cache("Москва", "weather", dict(WEATHER), WEATHER["id"], WEATHER["name"])
+        # Запись старше своего срока: в кэше есть только последние известные данные
+        entry = core._cache[core._city_cache_key(WEATHER["id"], "weather")]
+        entry["stale_at"], entry["expires_at"] = entry["fetched_at"] - 2, entry["fetched_at"] - 1
+        release = threading.Event()
+
+        def fake_request(url, params):
+            release.wait(5)
+            return dict(WEATHER)
+
+        def refresh():
+            with ratelimit.background():
+                weather_app.get_weather_by_city("Москва")
+
+        base = self.deduplicated()
+        with mock.patch.object(weather_app, "make_request", side_effect=fake_request), \
+                mock.patch.object(core, "RATE_LIMIT_MAX_WAIT_S", 0.05):
+            leader = threading.Thread(target=refresh)
+            leader.start()
+            self.addCleanup(leader.join)
+            self.addCleanup(release.set)
+            while not weather_app._flights:
+                time.sleep(0.005)
+            start = time.monotonic()
+            result = weather_app.get_weather_by_city("Москва")
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(self.deduplicated() - base, 1)
+        self.assertEqual(result["main"], WEATHER["main"])
+        self.assertIn(core.CACHED_AT_FIELD, result)
+
+    def test_async_one_request_for_concurrent_callers(self):
+        calls = []
+
+        async def fake_request(url, params):
+            calls.append(params["q"])
+            await asyncio.sleep(0.05)
+            return dict(WEATHER)
+
+        async def run():
+            return await asyncio.gather(*(async_weather.get_weather_by_city("Москва") for _ in range(8)))
+
+        with mock.patch.object(async_weather, "make_request", side_effect=fake_request):
+            results = asyncio.run(run())
+        self.assertEqual(calls, ["Москва"])
+        self.assertEqual(results, [WEATHER] * 8)
+
+class NotFoundTest(WeatherTestCase):
+    def fake_session(self, status: int) -> mock.Mock:
+        session = mock.Mock()
+        session.get.return_value = mock.Mock(status_code=status, ok=status < 400)
+        patcher = mock.patch.object(weather_app, "_session", session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return session
+
+    def test_404_is_cached_and_not_retried(self):
+        session = self.fake_session(404)
+        self.assertIsNone(weather_app.get_weather_by_city("Нигдеград"))
+        self.assertEqual(session.get.call_count, 1)
+        # Другое написание того же названия тоже отвечается из отрицательного кэша
+        self.assertIsNone(weather_app.get_weather_by_city(" нигдеград!"))
+        self.assertIsNone(weather_app.get_forecast_by_city("Нигдеград"))
+        self.assertEqual(session.get.call_count, 1)
+        # Ответ 404 - исправная работа сервиса, а не сбой
+        self.assertEqual(self.breaker.state, circuit.STATE_CLOSED)
+
+    def test_404_expires(self):
+        session = self.fake_session(404)
+        weather_app.get_weather_by_city("Нигдеград")
+        with mock.patch.object(core.time, "time", return_value=time.time() + core.NEGATIVE_CACHE_TTL_S + 1):
+            weather_app.get_weather_by_city("Нигдеград")
+        self.assertEqual(session.get.call_count, 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,167 +1,95 @@
+"""
+Синхронный клиент погоды: запросы к API через общую keep-alive сессию requests
+из потоков бота. Кэш, политика запросов и шаги получения данных - в weather_core.
+"""
 import os
 import requests
-from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 import time
-import json
-from datetime import datetime, timedelta
+import threading
+import concurrent.futures
 
-load_dotenv()
-API_KEY = os.getenv("API_KEY")
+import geocoder
+import metrics
+import ratelimit
+import weather_core as core
+# Общие с async_weather имена, которыми пользуются бот, планировщик и форматирование
+from weather_core import (  # noqa: F401
+    CACHED_AT_FIELD, NotFoundError, flush_cache, normalize_city, resolve_city_id, snap_to_grid
+)
 
-WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
-FORECAST_URL = "http://api.openweathermap.org/data/2.5/forecast"
-AIR_QUALITY_URL = "http://api.openweathermap.org/data/2.5/air_pollution"
-CACHE_FILE = "weather_cache.json"
-CACHE_TTL_HOURS = 1
-NOMINATIM_REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
+CACHE_REFRESH_WORKERS = 4
+# Сколько городов по названию запрашивается одновременно в get_weather_by_cities
+CITY_FETCH_WORKERS = 10
+# Потоки обработки обновлений бота (та же настройка, что в bot.py)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "16"))
+# Размер пула соединений HTTP-клиента на хост. Пул рассчитан на все потоки,
+# которые могут одновременно обращаться к одному хосту: обработчики бота,
+# запросы городов по названию, фоновые обновления кэша и планировщик.
+# Соединения сверх пула urllib3 закрывает после запроса, и keep-alive теряется.
+HTTP_POOL_SIZE = BOT_WORKERS + CITY_FETCH_WORKERS + CACHE_REFRESH_WORKERS + 1
 
-def _read_cache() -> list:
+def _create_session() -> requests.Session:
     """
-    Безопасно читает JSON-файл кэша.
-    Если файл не найден, пуст или содержит ошибку, возвращает пустой список.
+    Создает общую для всех потоков HTTP-сессию с пулом keep-alive соединений,
+    чтобы не устанавливать TCP+TLS соединение на каждый запрос.
     """
-    if not os.path.exists(CACHE_FILE):
-        return []
-    try:
-        if os.path.getsize(CACHE_FILE) == 0:
-            return []
-        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data if isinstance(data, list) else []
-    except (IOError, json.JSONDecodeError):
-        return []
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers['User-Agent'] = 'TelegramWeatherBot/1.0'
+    return session
 
-def _write_cache(data: list):
-    """
-    Безопасно записывает данные (список словарей) в JSON-файл кэша.
-    Args:
-        data: Список с данными для кэширования.
-    """
-    try:
-        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-    except IOError as e:
-        print(f"Ошибка записи в кэш: {e}")
+_session = _create_session()
 
-def _get_from_cache(city: str, req_type: str) -> dict | None:
-    """
-    Ищет свежие данные в кэше по названию города и типу запроса.
-    Args:
-        city: Название города для поиска.
-        req_type: Тип запроса (например, 'weather').
-    Returns:
-        Словарь с данными из кэша или None, если запись не найдена или устарела.
-    """
-    cache_list = _read_cache()
-    city_lower = city.lower()
-    for entry in cache_list:
-        if entry.get('city') == city_lower and entry.get('type') == req_type:
-            fetched_at = datetime.fromisoformat(entry['fetched_at'])
-            if datetime.now() - fetched_at < timedelta(hours=CACHE_TTL_HOURS):
-                return entry['data']
-            return None
-    return None
+class _Flight:
+    """Выполняющийся запрос, результата которого ждут другие потоки."""
 
-def _get_from_cache_by_coords(lat: float, lon: float, req_type: str) -> dict | None:
-    """
-    Ищет свежие данные в кэше по координатам (используется для качества воздуха).
-    Args:
-        lat: Широта.
-        lon: Долгота.
-        req_type: Тип запроса (например, 'air_quality').
-    Returns:
-        Словарь с данными из кэша или None, если запись не найдена или устарела.
-    """
-    cache_list = _read_cache()
-    for entry in cache_list:
-        if entry.get('lat') == lat and entry.get('lon') == lon and entry.get('type') == req_type:
-            fetched_at = datetime.fromisoformat(entry['fetched_at'])
-            if datetime.now() - fetched_at < timedelta(hours=CACHE_TTL_HOURS):
-                return entry['data']
-            return None
-    return None
-
-def _update_cache(city: str, req_type: str, data: dict):
-    """
-    Обновляет или добавляет запись в кэше для указанного города.
-    Args:
-        city: Название города, для которого сохраняются данные.
-        req_type: Тип запроса.
-        data: Словарь с данными от API.
-    """
-    cache_list = _read_cache()
-    city_lower = city.lower()
-    new_entry = {
-        'city': city_lower,
-        'type': req_type,
-        'fetched_at': datetime.now().isoformat(),
-        'data': data
-    }
-    found_and_updated = False
-    for i, entry in enumerate(cache_list):
-        if entry.get('city') == city_lower and entry.get('type') == req_type:
-            cache_list[i] = new_entry
-            found_and_updated = True
-            break
-    if not found_and_updated:
-        cache_list.append(new_entry)
-    _write_cache(cache_list)
+    def __init__(self):
+        self.done = threading.Event()
+        self.priority = ratelimit.current_priority()
+        self.result = None
+        self.error = None
 
-def _update_cache_by_coords(lat: float, lon: float, req_type: str, data: dict):
-    """
-    Обновляет или добавляет запись в кэше по координатам.
-    Args:
-        lat: Широта.
-        lon: Долгота.
-        req_type: Тип запроса.
-        data: Словарь с данными от API.
-    """
-    cache_list = _read_cache()
-    new_entry = {
-        'lat': lat, 'lon': lon,
-        'type': req_type,
-        'fetched_at': datetime.now().isoformat(),
-        'data': data
-    }
-    found_and_updated = False
-    for i, entry in enumerate(cache_list):
-        if entry.get('lat') == lat and entry.get('lon') == lon and entry.get('type') == req_type:
-            cache_list[i] = new_entry
-            found_and_updated = True
-            break
-    if not found_and_updated:
-        cache_list.append(new_entry)
-    _write_cache(cache_list)
+# Выполняющиеся запросы к API по ключу, см. _single_flight
+_flights = {}
+_flights_lock = threading.Lock()
+# Ключи single-flight, для которых уже запланировано фоновое обновление
+_refreshing = set()
+_refresh_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CACHE_REFRESH_WORKERS, thread_name_prefix="weather-cache-refresh"
+)
+_fetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=CITY_FETCH_WORKERS, thread_name_prefix="weather-fetch"
+)
 
 def get_location_details_by_coords(lat: float, lon: float) -> tuple[str, str] | None:
     """
-    Определяет город и код страны по координатам с помощью Nominatim.
+    Определяет город и код страны по координатам: сначала по офлайн-индексу
+    GeoNames, затем, если включено, с помощью Nominatim.
     Args:
         lat: Широта.
         lon: Долгота.
     Returns:
         Кортеж (название города, код страны) или None в случае ошибки.
     """
-    time.sleep(1)
-    headers = {'User-Agent': 'TelegramWeatherBot/1.0'}
-    params = {
-        "lat": lat,
-        "lon": lon,
-        "format": "json",
-        "accept-language": "ru"
-    }
+    details = geocoder.nearest_city(lat, lon)
+    if details or not core.NOMINATIM_FALLBACK:
+        return details
+    if not core.nominatim_breaker.allow():
+        return None
+    time.sleep(core.reserve_nominatim_slot())
     try:
-        response = requests.get(NOMINATIM_REVERSE_URL, params=params, headers=headers)
+        response = _session.get(core.NOMINATIM_REVERSE_URL, params=core.nominatim_params(lat, lon),
+                                timeout=(core.HTTP_CONNECT_TIMEOUT_S, core.HTTP_READ_TIMEOUT_S))
         response.raise_for_status()
         data = response.json()
-        address = data.get("address", {})
-        city = address.get("city") or address.get("town") or address.get("village")
-        country_code = address.get("country_code")
-        if city and country_code:
-            return city, country_code.upper()
-        return None
+        core.nominatim_breaker.record_success()
+        return core.parse_location_details(data)
     except requests.exceptions.RequestException as e:
         print(f"Ошибка при запросе к Nominatim: {e}")
+        core.nominatim_breaker.record_failure()
         return None
     except (KeyError, json.JSONDecodeError):
         print("Ошибка при обработке ответа от Nominatim.")
@@ -169,64 +97,211 @@ def get_location_details_by_coords(lat: float, lon: float) -> tuple[str, str] |
 
 def make_request(url: str, params: dict):
     """
-    Выполняет HTTP GET-запрос к API с обработкой ошибок и повторными попытками.
+    Выполняет HTTP GET-запрос к API с обработкой ошибок и повторными попытками
+    по общей с async_weather политике weather_core.request_policy.
     Args:
         url: URL-адрес эндпоинта API.
         params: Словарь с параметрами запроса.
     Returns:
         Словарь с JSON-ответом от API или None в случае неудачи.
+    Raises:
+        NotFoundError: API ответил 404; такой ответ окончательный и не повторяется.
     """
-    params["appid"] = API_KEY
-    retries = 3
-    delay = 1
-    for attempt in range(retries):
-        try:
-            response = requests.get(url, params=params)
-            if response.status_code == 401:
-                print("Ошибка: Неверный API ключ OpenWeather.")
-                return None
-            if response.status_code == 429:
-                print(f"Слишком много запросов. Повтор через {delay} сек.")
-                time.sleep(delay)
-                delay *= 2
-                continue
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Ошибка сети: {e}. Попытка {attempt + 1} из {retries}")
-            if attempt < retries - 1:
-                time.sleep(delay)
-                delay *= 2
+    policy = core.request_policy(url, params)
+    try:
+        step, arg = next(policy)
+        while True:
+            if step == core.STEP_ACQUIRE:
+                step, arg = policy.send(core.owm_limiter.acquire(timeout=arg))
+            elif step == core.STEP_SLEEP:
+                time.sleep(arg)
+                step, arg = policy.send(None)
+            else:
+                try:
+                    response = _session.get(
+                        url, params=params,
+                        timeout=(min(core.HTTP_CONNECT_TIMEOUT_S, arg), min(core.HTTP_READ_TIMEOUT_S, arg))
+                    )
+                    reply = response.status_code, response.json() if response.ok else None
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    step, arg = policy.throw(core.AttemptFailed(e))
+                else:
+                    step, arg = policy.send(reply)
+    except StopIteration as stop:
+        return stop.value
+
+def _run_fetch(steps, *args):
+    """
+    Выполняет шаги получения данных steps(*args) (генератор из weather_core):
+    каждый выданный им запрос (url, params) отправляется через make_request,
+    ответ (или NotFoundError) возвращается в генератор.
+    Returns:
+        Результат генератора.
+    """
+    gen = steps(*args)
+    try:
+        request = next(gen)
+        while True:
+            try:
+                data = make_request(*request)
+            except NotFoundError as e:
+                request = gen.throw(e)
             else:
-                return None
-    return None
+                request = gen.send(data)
+    except StopIteration as stop:
+        return stop.value
+
+def _single_flight(key: tuple, steps, *args):
+    """
+    Объединяет одновременные одинаковые запросы: шаги steps(*args) выполняет
+    только первый поток, остальные с тем же ключом ждут и получают его результат.
+    Если ожидание дольше core.follower_timeout, поток получает данные из кэша
+    (core.cached_result).
+    Args:
+        key: Ключ запроса (тип запроса и город или координаты).
+        steps: Шаги получения данных (см. _run_fetch).
+        args: Аргументы steps.
+    Returns:
+        Результат шагов.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        metrics.inc("weather_singleflight_deduplicated_total", kind=key[0])
+        if not flight.done.wait(core.follower_timeout(flight.priority)):
+            metrics.inc("weather_singleflight_timeout_total", kind=key[0])
+            return core.cached_result(steps, *args)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    metrics.inc("weather_singleflight_leader_total", kind=key[0])
+    try:
+        flight.result = _run_fetch(steps, *args)
+        return flight.result
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+
+def _refresh_in_background(key: tuple, steps, *args):
+    """
+    Планирует обновление устаревшей записи кэша в фоновом потоке
+    (stale-while-revalidate). Повторные вызовы для ключа, обновление
+    которого уже запланировано или выполняется, ничего не делают.
+    Args:
+        key: Ключ single-flight запроса.
+        steps: Шаги получения данных, кладущие их в кэш (см. _run_fetch).
+        args: Аргументы steps.
+    """
+    with _flights_lock:
+        if key in _refreshing or key in _flights:
+            return
+        _refreshing.add(key)
+    metrics.inc("weather_cache_background_refresh_total", kind=key[0])
+    _refresh_executor.submit(_run_refresh, key, steps, *args)
+
+def _run_refresh(key: tuple, steps, *args):
+    """Выполняет фоновое обновление записи кэша с фоновым приоритетом."""
+    try:
+        with ratelimit.background():
+            _single_flight(key, steps, *args)
+    except Exception as e:
+        print(f"Ошибка фонового обновления кэша {key}: {e}")
+    finally:
+        with _flights_lock:
+            _refreshing.discard(key)
+
+def _cached_or_fetch(lookup: tuple, key: tuple, steps, *args):
+    """
+    Общая часть функций get_*: отдает данные из кэша или запрашивает их у API
+    по правилам, описанным в weather_core.
+    Args:
+        lookup: Результат поиска в кэше (данные или None, устарели ли они).
+        key: Ключ single-flight запроса.
+        steps: Шаги получения данных (см. _run_fetch).
+        args: Аргументы steps.
+    """
+    cached_data, stale = lookup
+    if cached_data:
+        if stale: _refresh_in_background(key, steps, *args)
+        return cached_data
+    return _single_flight(key, steps, *args)
+
+def get_weather_by_coords(lat: float, lon: float) -> dict | None:
+    """
+    Получает текущую погоду по координатам, округленным до сетки COORDS_GRID_DEG,
+    одним запросом к API. Использует кэширование.
+    Args:
+        lat: Широта.
+        lon: Долгота.
+    Returns:
+        Словарь с данными о погоде или None.
+    """
+    lat, lon = snap_to_grid(lat, lon)
+    return _cached_or_fetch(core.lookup_cache_by_coords(lat, lon, 'weather'), ('weather_coords', lat, lon),
+                            core.weather_by_coords_steps, lat, lon)
 
 def get_weather_by_city(city: str) -> dict | None:
     """
-    Получает текущую погоду для города. Использует кэширование.
+    Получает текущую погоду для города. Использует кэширование,
+    в том числе отрицательное: неизвестный город не запрашивается повторно.
     Args:
         city: Название города.
     Returns:
         Словарь с данными о погоде или None.
     """
-    cached_data = _get_from_cache(city, 'weather')
-    if cached_data: return cached_data
-    data = make_request(WEATHER_URL, {"q": city, "units": "metric", "lang": "ru"})
-    if data:
-        api_city_name = data.get('name', city)
-        _update_cache(api_city_name, 'weather', data)
-    return data
+    return _cached_or_fetch(core.lookup_cache(city, 'weather'), core.city_flight_key('weather', city),
+                            core.weather_by_city_steps, city)
+
+def get_weather_for_cities(city_ids) -> dict:
+    """
+    Получает текущую погоду сразу для многих городов по их id OpenWeather.
+    Города без свежих данных в кэше запрашиваются пачками по GROUP_MAX_IDS
+    за один вызов API.
+    Args:
+        city_ids: id городов OpenWeather.
+    Returns:
+        Словарь {id города: данные о погоде}; города без данных в нем отсутствуют.
+    """
+    result, missing = core.split_cached_group(city_ids)
+    for chunk in core.group_chunks(missing):
+        result.update(_run_fetch(core.weather_group_steps, chunk))
+    core.add_last_known(result, missing)
+    return result
+
+def get_weather_by_cities(cities: list) -> list:
+    """
+    Получает текущую погоду для нескольких городов по названиям сразу.
+    Города, чье написание уже встречалось, запрашиваются одним пакетным вызовом
+    (get_weather_for_cities), остальные - одновременно по названию.
+    Args:
+        cities: Названия городов.
+    Returns:
+        Список данных о погоде (или None) в порядке cities.
+    """
+    city_ids = [resolve_city_id(city) for city in cities]
+    by_id = get_weather_for_cities(city_id for city_id in city_ids if city_id)
+    by_name = list(dict.fromkeys(city for city, city_id in zip(cities, city_ids) if city_id not in by_id))
+    fetched = dict(zip(by_name, _fetch_executor.map(get_weather_by_city, by_name)))
+    return core.merge_by_cities(cities, city_ids, by_id, fetched)
 
 def get_forecast_by_city(city: str) -> dict | None:
     """
-    Получает прогноз погоды на 5 дней для города. НЕ использует кэширование.
+    Получает прогноз погоды на 5 дней для города. Использует кэширование
+    до следующего 3-часового шага прогноза.
     Args:
         city: Название города.
     Returns:
         Словарь с данными прогноза или None.
     """
-    data = make_request(FORECAST_URL, {"q": city, "units": "metric", "lang": "ru"})
-    return data
+    return _cached_or_fetch(core.lookup_cache(city, 'forecast'), core.city_flight_key('forecast', city),
+                            core.forecast_by_city_steps, city)
 
 def get_air_quality(lat: float, lon: float) -> dict | None:
     """
@@ -237,11 +312,8 @@ def get_air_quality(lat: float, lon: float) -> dict | None:
     Returns:
         Словарь с данными о качестве воздуха или None.
     """
-    cached_data = _get_from_cache_by_coords(lat, lon, 'air_quality')
-    if cached_data: return cached_data
-    data = make_request(AIR_QUALITY_URL, {"lat": lat, "lon": lon})
-    if data: _update_cache_by_coords(lat, lon, 'air_quality', data)
-    return data
+    return _cached_or_fetch(core.lookup_cache_by_coords(lat, lon, 'air_quality'), ('air_quality', lat, lon),
+                            core.air_quality_steps, lat, lon)
 
 def format_air_quality(aqi: int) -> str:
     """
@@ -0,0 +1,766 @@
+"""
+Общее ядро клиентов погоды weather_app (потоки) и async_weather (event loop).
+
+Здесь все, что не зависит от способа ввода-вывода: настройки, кэш и псевдонимы
+городов, ограничитель и выключатели, политика запросов к OpenWeather
+(request_policy) и шаги получения данных (*_steps). Клиенты только выполняют
+выданные ими запросы и паузы своими средствами.
+
+Данные отдаются по одним правилам в обоих клиентах: свежая запись кэша -
+сразу; устаревшая - сразу, а в фоне запускается обновление (stale-while-
+revalidate); иначе данные запрашиваются у API, и одновременные запросы
+с одним ключом объединяются в один (single-flight). Если API недоступен,
+отдаются последние данные из кэша любой давности, помеченные полем
+CACHED_AT_FIELD.
+"""
+import os
+import time
+import json
+import atexit
+import threading
+import collections
+import re
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+import circuit
+import metrics
+import ratelimit
+
+load_dotenv()
+API_KEY = os.getenv("API_KEY")
+
+WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+FORECAST_URL = "https://api.openweathermap.org/data/2.5/forecast"
+AIR_QUALITY_URL = "https://api.openweathermap.org/data/2.5/air_pollution"
+GROUP_URL = "https://api.openweathermap.org/data/2.5/group"
+# Сколько городов API отдает за один запрос к GROUP_URL
+GROUP_MAX_IDS = 20
+CACHE_FILE = "weather_cache.json"
+CITY_ALIASES_FILE = "city_aliases.json"
+CACHE_TTL_HOURS = 1
+# Сколько еще после шага прогноза устаревший прогноз отдается сразу, пока его
+# обновляет фоновый поток; дальше запрос ждет API
+CACHE_MAX_STALE_HOURS = 6
+# То же для текущей погоды и качества воздуха после CACHE_TTL_HOURS: они быстро
+# меняются, поэтому без пометки CACHED_AT_FIELD отдаются недолго
+CURRENT_MAX_STALE_S = 30 * 60
+CACHE_MAX_ENTRIES = 5000
+CACHE_FLUSH_INTERVAL_S = 30
+# Сколько помнить, что город не найден (404), чтобы не тратить квоту на повторы
+NEGATIVE_CACHE_TTL_S = 10 * 60
+FORECAST_STEP_SECONDS = 3 * 3600
+# Шаг сетки (градусы), к которому округляются координаты запросов погоды по геолокации:
+# соседние точки (примерно 5 км) используют одну запись кэша
+COORDS_GRID_DEG = 0.05
+NOMINATIM_REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
+# Обращаться ли к Nominatim, если город не найден в офлайн-индексе,
+# и минимальный интервал между запросами к нему по всему процессу (правила Nominatim)
+NOMINATIM_FALLBACK = os.getenv("NOMINATIM_FALLBACK", "1") == "1"
+NOMINATIM_MIN_INTERVAL_S = 1.0
+# Таймауты HTTP-клиента (сек.) на установку соединения и чтение ответа
+# и общий предел на вызов с повторами
+HTTP_CONNECT_TIMEOUT_S = 3.05
+HTTP_READ_TIMEOUT_S = 10
+REQUEST_DEADLINE_S = 15
+
+# Квота тарифа OpenWeather (запросов в минуту) и сколько интерактивный запрос
+# готов ждать свободный токен, прежде чем сдаться
+OWM_CALLS_PER_MINUTE = int(os.getenv("OWM_CALLS_PER_MINUTE", "60"))
+RATE_LIMIT_MAX_WAIT_S = 2
+# Выключатели внешних сервисов: при доле неудачных вызовов не меньше
+# BREAKER_FAILURE_RATE за BREAKER_WINDOW_S секунд (и хотя бы BREAKER_MIN_CALLS
+# вызовах) сервис не вызывается BREAKER_RESET_S секунд, затем пробный запрос
+BREAKER_FAILURE_RATE = 0.5
+BREAKER_WINDOW_S = 60
+BREAKER_MIN_CALLS = 5
+BREAKER_RESET_S = 30
+# Поле, которым помечаются данные, отданные из кэша без обновления
+# (API недоступен): время их получения от API, timestamp
+CACHED_AT_FIELD = '_cached_at'
+
+# Общие для всех потоков и event loop ограничитель запросов к OpenWeather
+# и выключатели OpenWeather и Nominatim
+owm_limiter = ratelimit.TokenBucket(OWM_CALLS_PER_MINUTE)
+owm_breaker = circuit.CircuitBreaker(
+    "OpenWeather", BREAKER_FAILURE_RATE, BREAKER_WINDOW_S, BREAKER_MIN_CALLS, BREAKER_RESET_S
+)
+nominatim_breaker = circuit.CircuitBreaker(
+    "Nominatim", BREAKER_FAILURE_RATE, BREAKER_WINDOW_S, BREAKER_MIN_CALLS, BREAKER_RESET_S
+)
+
+class NotFoundError(Exception):
+    """API ответил 404: запрошенного города не существует, повторять запрос бессмысленно."""
+
+def rate_limit_timeout() -> float | None:
+    """Интерактивные запросы ждут токен ограниченное время, фоновые - сколько нужно."""
+    if ratelimit.current_priority() == ratelimit.PRIORITY_INTERACTIVE:
+        return RATE_LIMIT_MAX_WAIT_S
+    return None
+
+# Кэш в памяти процесса: ключ -> {'fetched_at', 'stale_at', 'expires_at', 'data'}.
+# После stale_at запись устарела, но еще отдается (с фоновым обновлением),
+# после expires_at отдается, только если API недоступен. Записи без периода
+# устаревания (отрицательный кэш) после expires_at удаляются.
+# Порядок OrderedDict отражает давность использования (LRU).
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+_cache_write_lock = threading.Lock()
+_cache_loaded = False
+_cache_dirty = False
+# Псевдонимы городов: нормализованный ввод пользователя -> id города OpenWeather.
+# Защищены тем же _cache_lock и сохраняются на диск тем же фоновым потоком.
+_aliases = {}
+_aliases_dirty = False
+
+_nominatim_lock = threading.Lock()
+_nominatim_next_slot = 0.0
+
+def reserve_nominatim_slot() -> float:
+    """
+    Резервирует ближайший разрешенный момент запроса к Nominatim так,
+    чтобы запросы всего процесса шли не чаще раза в NOMINATIM_MIN_INTERVAL_S.
+    Returns:
+        Сколько секунд нужно подождать перед запросом.
+    """
+    global _nominatim_next_slot
+    with _nominatim_lock:
+        now = time.monotonic()
+        slot = max(now, _nominatim_next_slot)
+        _nominatim_next_slot = slot + NOMINATIM_MIN_INTERVAL_S
+    return slot - now
+
+def _read_cache() -> list:
+    """
+    Безопасно читает JSON-файл кэша.
+    Если файл не найден, пуст или содержит ошибку, возвращает пустой список.
+    """
+    if not os.path.exists(CACHE_FILE):
+        return []
+    try:
+        if os.path.getsize(CACHE_FILE) == 0:
+            return []
+        with open(CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            return data if isinstance(data, list) else []
+    except (IOError, json.JSONDecodeError):
+        return []
+
+def _write_cache(data: list):
+    """
+    Безопасно записывает данные (список словарей) в JSON-файл кэша.
+    Args:
+        data: Список с данными для кэширования.
+    """
+    try:
+        with open(CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+    except IOError as e:
+        print(f"Ошибка записи в кэш: {e}")
+
+def _city_cache_key(city_id: int, req_type: str) -> tuple:
+    """Ключ записи кэша по id города OpenWeather."""
+    return ('city_id', city_id, req_type)
+
+def _coords_cache_key(lat: float, lon: float, req_type: str) -> tuple:
+    """Ключ записи кэша по координатам."""
+    return ('coords', lat, lon, req_type)
+
+def snap_to_grid(lat: float, lon: float) -> tuple[float, float]:
+    """Округляет координаты до узла сетки COORDS_GRID_DEG."""
+    return (round(round(lat / COORDS_GRID_DEG) * COORDS_GRID_DEG, 4),
+            round(round(lon / COORDS_GRID_DEG) * COORDS_GRID_DEG, 4))
+
+def _not_found_cache_key(city: str) -> tuple:
+    """Ключ отрицательной записи кэша: город, для которого API ответил 404."""
+    return ('not_found', normalize_city(city))
+
+def normalize_city(city: str) -> str:
+    """
+    Приводит название города к виду для поиска псевдонима: без учета регистра,
+    без пробелов и знаков препинания по краям, с одинарными пробелами внутри, ё -> е.
+    Args:
+        city: Название города в том виде, как его ввел пользователь.
+    Returns:
+        Нормализованное название.
+    """
+    city = city.casefold().replace('ё', 'е')
+    city = re.sub(r'\s+', ' ', city)
+    return re.sub(r'^[\W_]+|[\W_]+$', '', city)
+
+def _load_aliases() -> dict:
+    """Читает файл псевдонимов городов; при ошибке возвращает пустой словарь."""
+    if not os.path.exists(CITY_ALIASES_FILE):
+        return {}
+    try:
+        with open(CITY_ALIASES_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {alias: int(city_id) for alias, city_id in data.items()} if isinstance(data, dict) else {}
+    except (IOError, json.JSONDecodeError, TypeError, ValueError):
+        return {}
+
+def _write_aliases(aliases: dict):
+    """Записывает псевдонимы городов в файл."""
+    try:
+        with open(CITY_ALIASES_FILE, 'w', encoding='utf-8') as f:
+            json.dump(aliases, f, ensure_ascii=False, indent=4)
+    except IOError as e:
+        print(f"Ошибка записи псевдонимов городов: {e}")
+
+def _ensure_cache_loaded():
+    """
+    При первом обращении загружает кэш с диска в память
+    и запускает фоновый поток сохранения. Вызывается под _cache_lock.
+    """
+    global _cache_loaded
+    if _cache_loaded:
+        return
+    _cache_loaded = True
+    _aliases.update(_load_aliases())
+    now = time.time()
+    for entry in _read_cache():
+        key = tuple(entry['key']) if isinstance(entry.get('key'), list) else None
+        try:
+            fetched_at = datetime.fromisoformat(entry['fetched_at']).timestamp()
+            expires_at = (datetime.fromisoformat(entry['expires_at']).timestamp()
+                          if 'expires_at' in entry else fetched_at + CACHE_TTL_HOURS * 3600)
+            stale_at = (datetime.fromisoformat(entry['stale_at']).timestamp()
+                        if 'stale_at' in entry else expires_at)
+        except (KeyError, TypeError, ValueError):
+            continue
+        if key is None or (expires_at <= now and stale_at >= expires_at):
+            continue
+        _cache[key] = {'fetched_at': fetched_at, 'stale_at': stale_at, 'expires_at': expires_at,
+                       'data': entry.get('data')}
+    while len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    threading.Thread(target=_cache_flush_loop, name="weather-cache-flusher", daemon=True).start()
+
+def _cache_lookup(key: tuple) -> tuple[dict | None, bool]:
+    """
+    Возвращает данные из кэша в памяти за O(1), в том числе устаревшие.
+    Args:
+        key: Ключ записи.
+    Returns:
+        Кортеж (данные, устарели ли они). Данные None, если записи нет
+        или истек ее полный срок жизни.
+    """
+    global _cache_dirty
+    with _cache_lock:
+        _ensure_cache_loaded()
+        entry = _cache.get(key)
+        if entry is None:
+            return None, False
+        now = time.time()
+        if now >= entry['expires_at']:
+            if entry['stale_at'] >= entry['expires_at']:
+                del _cache[key]
+                _cache_dirty = True
+            return None, False
+        _cache.move_to_end(key)
+        return entry['data'], now >= entry['stale_at']
+
+def _cache_get(key: tuple) -> dict | None:
+    """
+    Возвращает свежие данные из кэша в памяти за O(1).
+    Args:
+        key: Ключ записи.
+    Returns:
+        Данные или None, если записи нет или она устарела.
+    """
+    data, stale = _cache_lookup(key)
+    return None if stale else data
+
+def _cache_last_known(key: tuple) -> dict | None:
+    """
+    Возвращает последние полученные данные из кэша любой давности, помеченные
+    полем CACHED_AT_FIELD. Используется, когда API недоступен.
+    Args:
+        key: Ключ записи.
+    Returns:
+        Копия данных с пометкой или None, если записи нет.
+    """
+    with _cache_lock:
+        _ensure_cache_loaded()
+        entry = _cache.get(key)
+        if entry is None or not entry['data']:
+            return None
+        data = {**entry['data'], CACHED_AT_FIELD: entry['fetched_at']}
+    metrics.inc("weather_cache_degraded_served_total", kind=key[-1])
+    return data
+
+def _cache_put(key: tuple, data: dict, ttl_seconds: float, max_stale_seconds: float = 0):
+    """
+    Кладет данные в кэш, вытесняя самые давно использованные записи
+    сверх CACHE_MAX_ENTRIES. Запись на диск выполняет фоновый поток.
+    Args:
+        key: Ключ записи.
+        data: Словарь с данными от API.
+        ttl_seconds: Сколько секунд запись считается свежей.
+        max_stale_seconds: Сколько секунд после этого запись еще отдается устаревшей.
+    """
+    global _cache_dirty
+    now = time.time()
+    with _cache_lock:
+        _ensure_cache_loaded()
+        stale_at = now + ttl_seconds
+        _cache[key] = {'fetched_at': now, 'stale_at': stale_at, 'expires_at': stale_at + max_stale_seconds,
+                       'data': data}
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+        _cache_dirty = True
+
+def flush_cache():
+    """Сохраняет кэш и псевдонимы городов в файлы, если они изменились с последнего сохранения."""
+    global _cache_dirty, _aliases_dirty
+    with _cache_lock:
+        snapshot = aliases = None
+        if _cache_dirty:
+            snapshot = [
+                {
+                    'key': list(key),
+                    'fetched_at': datetime.fromtimestamp(entry['fetched_at']).isoformat(),
+                    'stale_at': datetime.fromtimestamp(entry['stale_at']).isoformat(),
+                    'expires_at': datetime.fromtimestamp(entry['expires_at']).isoformat(),
+                    'data': entry['data']
+                }
+                for key, entry in _cache.items()
+            ]
+            _cache_dirty = False
+        if _aliases_dirty:
+            aliases = dict(_aliases)
+            _aliases_dirty = False
+    with _cache_write_lock:
+        if snapshot is not None:
+            _write_cache(snapshot)
+        if aliases is not None:
+            _write_aliases(aliases)
+
+def _cache_flush_loop():
+    """Периодически сбрасывает кэш на диск вне потоков обработки запросов."""
+    while True:
+        time.sleep(CACHE_FLUSH_INTERVAL_S)
+        flush_cache()
+
+atexit.register(flush_cache)
+
+def resolve_city_id(city: str) -> int | None:
+    """
+    Находит id города OpenWeather по любому ранее встречавшемуся написанию.
+    Args:
+        city: Название города.
+    Returns:
+        id города или None, если такое написание еще не встречалось.
+    """
+    with _cache_lock:
+        _ensure_cache_loaded()
+        return _aliases.get(normalize_city(city))
+
+def _remember_city(city_id: int, city: str | None = None, canonical_name: str | None = None,
+                   country: str | None = None):
+    """
+    Запоминает написания города как псевдонимы его id.
+    Написание, которое ввел пользователь, всегда указывает на город из ответа API
+    на этот запрос. Каноническое название из ответа одно у разных городов
+    ("Moscow,US" отвечает городом "Moscow" в Айдахо), поэтому оно запоминается
+    вместе с кодом страны, а само по себе - только для запроса без страны
+    и только если такого псевдонима еще нет. Существующий псевдоним
+    канонического названия никогда не перезаписывается.
+    Args:
+        city_id: id города OpenWeather.
+        city: Название города в том виде, как его ввел пользователь (None для
+            ответов на запросы не по названию).
+        canonical_name: Название города из ответа API.
+        country: Код страны из ответа API.
+    """
+    global _aliases_dirty
+    typed = normalize_city(city) if city else ''
+    aliases = []
+    if canonical_name:
+        if country:
+            aliases.append(normalize_city(f"{canonical_name},{country}"))
+        if typed and ',' not in typed:
+            aliases.append(normalize_city(canonical_name))
+    with _cache_lock:
+        _ensure_cache_loaded()
+        if typed and _aliases.get(typed) != city_id:
+            _aliases[typed] = city_id
+            _aliases_dirty = True
+        for alias in aliases:
+            if alias and alias not in _aliases:
+                _aliases[alias] = city_id
+                _aliases_dirty = True
+
+def _get_from_cache(city: str, req_type: str) -> dict | None:
+    """
+    Ищет свежие данные в кэше по названию города и типу запроса.
+    Любое известное написание города ведет к одной записи по его id.
+    Args:
+        city: Название города для поиска.
+        req_type: Тип запроса (например, 'weather').
+    Returns:
+        Словарь с данными из кэша или None, если запись не найдена или устарела.
+    """
+    city_id = resolve_city_id(city)
+    if city_id is None:
+        return None
+    return _cache_get(_city_cache_key(city_id, req_type))
+
+def lookup_cache(city: str, req_type: str) -> tuple[dict | None, bool]:
+    """
+    Ищет в кэше данные по названию города, в том числе устаревшие.
+    Args:
+        city: Название города для поиска.
+        req_type: Тип запроса (например, 'weather').
+    Returns:
+        Кортеж (данные или None, устарели ли они).
+    """
+    city_id = resolve_city_id(city)
+    if city_id is None:
+        return None, False
+    return _cache_lookup(_city_cache_key(city_id, req_type))
+
+def lookup_cache_by_coords(lat: float, lon: float, req_type: str) -> tuple[dict | None, bool]:
+    """
+    Ищет в кэше данные по координатам, в том числе устаревшие.
+    Args:
+        lat: Широта.
+        lon: Долгота.
+        req_type: Тип запроса (например, 'air_quality').
+    Returns:
+        Кортеж (данные или None, устарели ли они).
+    """
+    return _cache_lookup(_coords_cache_key(lat, lon, req_type))
+
+def _get_from_cache_by_coords(lat: float, lon: float, req_type: str) -> dict | None:
+    """
+    Ищет свежие данные в кэше по координатам (используется для качества воздуха).
+    Args:
+        lat: Широта.
+        lon: Долгота.
+        req_type: Тип запроса (например, 'air_quality').
+    Returns:
+        Словарь с данными из кэша или None, если запись не найдена или устарела.
+    """
+    return _cache_get(_coords_cache_key(lat, lon, req_type))
+
+def _last_known(city: str, req_type: str) -> dict | None:
+    """
+    Возвращает последние полученные данные для города любой давности (см. _cache_last_known).
+    Args:
+        city: Название города.
+        req_type: Тип запроса.
+    """
+    city_id = resolve_city_id(city)
+    if city_id is None:
+        return None
+    return _cache_last_known(_city_cache_key(city_id, req_type))
+
+def _last_known_by_coords(lat: float, lon: float, req_type: str) -> dict | None:
+    """
+    Возвращает последние полученные данные по координатам любой давности (см. _cache_last_known).
+    Args:
+        lat: Широта.
+        lon: Долгота.
+        req_type: Тип запроса.
+    """
+    return _cache_last_known(_coords_cache_key(lat, lon, req_type))
+
+def _max_stale_seconds(req_type: str) -> float:
+    """Сколько секунд устаревшая запись данного типа еще отдается сразу."""
+    return CACHE_MAX_STALE_HOURS * 3600 if req_type == 'forecast' else CURRENT_MAX_STALE_S
+
+def _update_cache(city: str | None, req_type: str, data: dict, city_id: int | None, canonical_name: str | None,
+                  ttl_seconds: float = CACHE_TTL_HOURS * 3600):
+    """
+    Обновляет или добавляет запись в кэше для города и запоминает его написания.
+    Args:
+        city: Название города в том виде, как его запросили (None, если запрос был не по названию).
+        req_type: Тип запроса.
+        data: Словарь с данными от API.
+        city_id: id города из ответа API (без него запись не кэшируется).
+        canonical_name: Название города из ответа API.
+        ttl_seconds: Время жизни записи в секундах.
+    """
+    if not city_id:
+        return
+    # Код страны: в ответе о погоде - sys.country, в прогнозе - city.country
+    country = (data.get('sys') or data.get('city') or {}).get('country')
+    _remember_city(city_id, city, canonical_name, country)
+    _cache_put(_city_cache_key(city_id, req_type), data, ttl_seconds, _max_stale_seconds(req_type))
+
+def _is_known_missing(city: str) -> bool:
+    """Проверяет, отвечал ли API недавно, что такого города нет."""
+    return _cache_get(_not_found_cache_key(city)) is not None
+
+def _remember_missing(city: str):
+    """Запоминает на NEGATIVE_CACHE_TTL_S, что такого города нет."""
+    _cache_put(_not_found_cache_key(city), {}, NEGATIVE_CACHE_TTL_S)
+
+def _update_cache_by_coords(lat: float, lon: float, req_type: str, data: dict):
+    """
+    Обновляет или добавляет запись в кэше по координатам.
+    Args:
+        lat: Широта.
+        lon: Долгота.
+        req_type: Тип запроса.
+        data: Словарь с данными от API.
+    """
+    _cache_put(_coords_cache_key(lat, lon, req_type), data, CACHE_TTL_HOURS * 3600, _max_stale_seconds(req_type))
+
+def parse_location_details(data: dict) -> tuple[str, str] | None:
+    """
+    Извлекает город и код страны из ответа Nominatim.
+    Args:
+        data: JSON-ответ Nominatim.
+    Returns:
+        Кортеж (название города, код страны) или None.
+    """
+    address = data.get("address", {})
+    city = address.get("city") or address.get("town") or address.get("village")
+    country_code = address.get("country_code")
+    if city and country_code:
+        return city, country_code.upper()
+    return None
+
+def nominatim_params(lat: float, lon: float) -> dict:
+    """Параметры запроса обратного геокодирования к Nominatim."""
+    return {
+        "lat": lat,
+        "lon": lon,
+        "format": "json",
+        "accept-language": "ru"
+    }
+
+class AttemptFailed(Exception):
+    """Попытка запроса не удалась: ошибка сети, таймаут, ошибочный статус или неверный JSON."""
+
+# Шаги request_policy, которые выполняет клиент (make_request в weather_app или async_weather)
+STEP_ACQUIRE = "acquire"
+STEP_SEND = "send"
+STEP_SLEEP = "sleep"
+
+def request_policy(url: str, params: dict):
+    """
+    Политика вызова OpenWeather, общая для синхронного и асинхронного клиентов:
+    выключатель owm_breaker, ограничитель owm_limiter, повторы с растущей паузой,
+    общий предел REQUEST_DEADLINE_S и обработка статусов ответа. Предел
+    отсчитывается с получения первого токена: ожидание в очереди ограничителя
+    не ошибка сервиса, и без отправленного запроса выключатель не срабатывает.
+    Сам генератор ввода-вывода не выполняет, а выдает шаги (шаг, аргумент):
+        STEP_ACQUIRE, timeout - взять токен owm_limiter; в ответ - получен ли он;
+        STEP_SEND, remaining - выполнить GET не дольше remaining секунд; в ответ -
+            (статус, JSON-ответ или None, если статус ошибочный), а при ошибке сети
+            или разбора ответа - исключение AttemptFailed через throw();
+        STEP_SLEEP, delay - пауза перед повтором.
+    Args:
+        url: URL-адрес эндпоинта API.
+        params: Словарь с параметрами запроса (в него добавляется ключ API).
+    Returns:
+        Результат генератора (StopIteration.value): JSON-ответ или None в случае неудачи.
+    Raises:
+        NotFoundError: API ответил 404; такой ответ окончательный и не повторяется.
+    """
+    if not owm_breaker.allow():
+        print("OpenWeather недоступен, запрос пропущен.")
+        return None
+    params["appid"] = API_KEY or ""
+    retries = 3
+    delay = 1
+    deadline = None
+    for attempt in range(retries):
+        # Если за время паузы выключатель разомкнули другие вызовы, повторять бессмысленно
+        if attempt and owm_breaker.is_open():
+            return None
+        if not (yield STEP_ACQUIRE, rate_limit_timeout()):
+            print("Исчерпана квота запросов к OpenWeather.")
+            return None
+        if deadline is None:
+            deadline = time.monotonic() + REQUEST_DEADLINE_S
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            print("Превышено время ожидания ответа API.")
+            owm_breaker.record_failure()
+            return None
+        try:
+            status, data = yield STEP_SEND, remaining
+            if status == 401:
+                print("Ошибка: Неверный API ключ OpenWeather.")
+                return None
+            if status == 404:
+                owm_breaker.record_success()
+                raise NotFoundError(params.get("q", url))
+            if status == 429:
+                print(f"Слишком много запросов. Повтор через {delay} сек.")
+                if deadline - time.monotonic() <= delay:
+                    break
+                yield STEP_SLEEP, delay
+                delay *= 2
+                continue
+            if data is None:
+                raise AttemptFailed(f"HTTP {status}")
+            owm_breaker.record_success()
+            return data
+        except AttemptFailed as e:
+            print(f"Ошибка сети: {e}. Попытка {attempt + 1} из {retries}")
+            if attempt < retries - 1 and deadline - time.monotonic() > delay:
+                yield STEP_SLEEP, delay
+                delay *= 2
+            else:
+                break
+    owm_breaker.record_failure()
+    return None
+
+def follower_timeout(leader_priority: int) -> float | None:
+    """
+    Сколько вызов ждет результат уже выполняющегося запроса с тем же ключом
+    (single-flight). Интерактивный вызов ждет фоновый запрос не дольше, чем
+    ждал бы токен сам: фоновый может долго стоять в очереди ограничителя.
+    Args:
+        leader_priority: Приоритет вызова, выполняющего запрос.
+    Returns:
+        Время ожидания в секундах или None - до завершения запроса.
+    """
+    if leader_priority == ratelimit.PRIORITY_BACKGROUND:
+        return rate_limit_timeout()
+    return None
+
+def cached_result(steps, *args):
+    """
+    Результат шагов steps(*args) без обращения к API, как если бы API был
+    недоступен: данные из кэша или последние известные данные.
+    """
+    gen = steps(*args)
+    try:
+        next(gen)
+        gen.send(None)
+    except StopIteration as stop:
+        return stop.value
+    finally:
+        gen.close()
+    return None
+
+def city_flight_key(req_type: str, city: str) -> tuple:
+    """Ключ single-flight для запроса по городу: id, если написание известно, иначе нормализованное название."""
+    return (req_type, resolve_city_id(city) or normalize_city(city))
+
+def _forecast_ttl_seconds() -> float:
+    """
+    Время жизни прогноза: до ближайшей границы 3-часового шага прогноза (UTC),
+    когда OpenWeather сдвигает ряд прогноза на следующий интервал.
+    """
+    now = time.time()
+    next_slot = (now // FORECAST_STEP_SECONDS + 1) * FORECAST_STEP_SECONDS
+    return next_slot - now
+
+# Шаги получения данных. Каждый выдает запрос (url, params), получает ответ
+# make_request клиента (или NotFoundError) и возвращает результат, обновив кэш.
+
+def weather_by_coords_steps(lat: float, lon: float):
+    """Текущая погода по координатам: кладет ее в кэш и запоминает название города."""
+    # Кэш мог заполнить запрос, завершившийся между проверкой и началом этого
+    cached_data = _get_from_cache_by_coords(lat, lon, 'weather')
+    if cached_data: return cached_data
+    try:
+        data = yield WEATHER_URL, {"lat": lat, "lon": lon, "units": "metric", "lang": "ru"}
+    except NotFoundError:
+        return None
+    if not data: return _last_known_by_coords(lat, lon, 'weather')
+    _update_cache_by_coords(lat, lon, 'weather', data)
+    if data.get('id') and data.get('name'):
+        _remember_city(data['id'], canonical_name=data['name'], country=data.get('sys', {}).get('country'))
+    return data
+
+def weather_by_city_steps(city: str):
+    """Текущая погода по названию города с отрицательным кэшированием."""
+    cached_data = _get_from_cache(city, 'weather')
+    if cached_data: return cached_data
+    if _is_known_missing(city): return None
+    try:
+        data = yield WEATHER_URL, {"q": city, "units": "metric", "lang": "ru"}
+    except NotFoundError:
+        _remember_missing(city)
+        return None
+    if not data: return _last_known(city, 'weather')
+    _update_cache(city, 'weather', data, data.get('id'), data.get('name'))
+    return data
+
+def weather_group_steps(city_ids: list):
+    """
+    Текущая погода для пачки (не больше GROUP_MAX_IDS) городов одним вызовом API.
+    Возвращает словарь {id города: данные о погоде} для городов из ответа.
+    """
+    metrics.inc("weather_group_requests_total")
+    try:
+        data = yield GROUP_URL, {"id": ",".join(str(city_id) for city_id in city_ids),
+                                 "units": "metric", "lang": "ru"}
+    except NotFoundError:
+        return {}
+    result = {}
+    for item in (data or {}).get('list', []):
+        city_id = item.get('id')
+        if not city_id:
+            continue
+        _update_cache(None, 'weather', item, city_id, item.get('name'))
+        result[city_id] = item
+    return result
+
+def forecast_by_city_steps(city: str):
+    """Прогноз по названию города; кэшируется до следующего шага прогноза."""
+    cached_data = _get_from_cache(city, 'forecast')
+    if cached_data: return cached_data
+    if _is_known_missing(city): return None
+    try:
+        data = yield FORECAST_URL, {"q": city, "units": "metric", "lang": "ru"}
+    except NotFoundError:
+        _remember_missing(city)
+        return None
+    if not data: return _last_known(city, 'forecast')
+    city_info = data.get('city', {})
+    _update_cache(city, 'forecast', data, city_info.get('id'), city_info.get('name'), _forecast_ttl_seconds())
+    return data
+
+def air_quality_steps(lat: float, lon: float):
+    """Качество воздуха по координатам."""
+    cached_data = _get_from_cache_by_coords(lat, lon, 'air_quality')
+    if cached_data: return cached_data
+    try:
+        data = yield AIR_QUALITY_URL, {"lat": lat, "lon": lon}
+    except NotFoundError:
+        return None
+    if not data: return _last_known_by_coords(lat, lon, 'air_quality')
+    _update_cache_by_coords(lat, lon, 'air_quality', data)
+    return data
+
+def split_cached_group(city_ids) -> tuple[dict, list]:
+    """
+    Делит id городов на те, у которых в кэше есть свежие данные, и остальные.
+    Returns:
+        Кортеж ({id города: данные из кэша}, [id городов для запроса к API]).
+    """
+    result = {}
+    missing = []
+    for city_id in dict.fromkeys(city_ids):
+        cached_data, stale = _cache_lookup(_city_cache_key(city_id, 'weather'))
+        if cached_data and not stale:
+            result[city_id] = cached_data
+        else:
+            missing.append(city_id)
+    return result, missing
+
+def group_chunks(city_ids: list) -> list:
+    """Разбивает id городов на пачки по GROUP_MAX_IDS для запросов к GROUP_URL."""
+    return [city_ids[start:start + GROUP_MAX_IDS] for start in range(0, len(city_ids), GROUP_MAX_IDS)]
+
+def add_last_known(result: dict, city_ids: list):
+    """Дополняет result последними данными из кэша для городов, которых API не вернул."""
+    for city_id in city_ids:
+        if city_id not in result:
+            last_known = _cache_last_known(_city_cache_key(city_id, 'weather'))
+            if last_known: result[city_id] = last_known
+
+def merge_by_cities(cities: list, city_ids: list, by_id: dict, by_name: dict) -> list:
+    """Собирает ответ get_weather_by_cities в порядке cities из полученного по id и по названию."""
+    return [by_id[city_id] if city_id in by_id else by_name[city] for city, city_id in zip(cities, city_ids)]
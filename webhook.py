@@ -0,0 +1,133 @@
+"""
+Прием обновлений Telegram через webhook вместо long polling.
+
+Встроенный HTTP-сервер принимает обновления, проверяет секретный токен
+из заголовка X-Telegram-Bot-Api-Secret-Token и кладет их в ограниченную
+очередь, которую разбирают рабочие потоки, вызывая обычные обработчики бота.
+Если очередь заполнена, сервер отвечает 503 и Telegram повторит доставку позже.
+"""
+import hmac
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_WORKERS = 16
+# Максимальный размер тела запроса с обновлением, байт
+MAX_UPDATE_SIZE = 1024 * 1024
+
+class WebhookServer:
+    """HTTP-сервер webhook с ограниченной очередью обновлений и пулом обработчиков."""
+
+    def __init__(self, bot, secret_token: str, host: str = "0.0.0.0", port: int = 8443,
+                 path: str = WEBHOOK_PATH, workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE):
+        """
+        Args:
+            bot: Экземпляр telebot.TeleBot. Чтобы очередь действительно ограничивала
+                объем работы, бот должен быть создан с threaded=False: тогда
+                обработчики выполняются прямо в рабочих потоках сервера.
+            secret_token: Секрет, переданный в set_webhook(secret_token=...).
+            host: Адрес, на котором слушает сервер.
+            port: Порт сервера.
+            path: Путь, на который Telegram отправляет обновления.
+            workers: Число рабочих потоков, обрабатывающих обновления.
+            queue_size: Максимальное число обновлений, ожидающих обработки.
+        """
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.workers = workers
+        self.updates = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        """Фактический порт сервера (полезно при port=0)."""
+        return self.httpd.server_address[1]
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                # Пока тело запроса не прочитано, ответ закрывает соединение: иначе
+                # следующий запрос keep-alive соединения читался бы с остатка тела
+                if self.path != server.path:
+                    return self._reply(404, close=True)
+                token = self.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+                if not hmac.compare_digest(token, server.secret_token):
+                    return self._reply(403, close=True)
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    return self._reply(400, close=True)
+                if length <= 0 or length > MAX_UPDATE_SIZE:
+                    return self._reply(400, close=True)
+                body = self.rfile.read(length)
+                try:
+                    update = types.Update.de_json(body.decode("utf-8"))
+                except ValueError:
+                    return self._reply(400)
+                try:
+                    server.updates.put_nowait(update)
+                except queue.Full:
+                    return self._reply(503)
+                self._reply(200)
+
+            def _reply(self, status: int, close: bool = False):
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                if close:
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _worker(self):
+        """Забирает обновления из очереди и передает их обработчикам бота."""
+        while True:
+            update = self.updates.get()
+            if update is None:
+                return
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Ошибка при обработке обновления {update.update_id}: {e}")
+
+    def _start_workers(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"webhook-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def start(self):
+        """Запускает рабочие потоки и HTTP-сервер в фоне."""
+        self._start_workers()
+        threading.Thread(target=self.httpd.serve_forever, name="webhook-server", daemon=True).start()
+
+    def serve_forever(self):
+        """Запускает рабочие потоки и обслуживает HTTP-сервер в текущем потоке."""
+        self._start_workers()
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Останавливает прием обновлений и дожидается разбора очереди."""
+        self.httpd.shutdown()
+        for _ in self._threads:
+            self.updates.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []